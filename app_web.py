@@ -1,19 +1,27 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import io
-import re
-import random
-import pickle
 import json
 import os
-from collections import Counter
+import time
+from schedule_core import (
+    parse_calendar_config, get_open_periods, build_calendar_index, get_week_ranges,
+    get_student_names, new_shift_store, align_shift_store, shift_person_index, shift_week_df,
+    shift_edits_from_editor, apply_shift_edits, shift_store_avail, check_sufficiency, get_requirements,
+    requested_totals, new_sufficiency_counters, update_sufficiency_shift, update_sufficiency_requests, sufficiency_summary,
+    solve_greedy, solve_flow, solve_multi_start, repair_schedule, improve_schedule,
+    build_schedule_view, schedule_grid_text, student_timetable, EXCEL_EXTRA_SHEETS, cached_schedule_excel,
+    new_profile, phase, record_solver_counters, append_profile_log,
+    schedule_fingerprint, get_cached_result, put_cached_result, new_solve_job, job_reporter, start_solve_job,
+    dump_calendar_config, encode_save_data, read_save_file, import_availability
+)
 
 # ==========================================
 # 0. 設定・定数
 # ==========================================
 ADMIN_PASSWORD = "2020"
 CONFIG_FILE = "admin_settings.json"
+PROFILE_LOG_FILE = "performance_log.jsonl"
 
 # ==========================================
 # 1. 保存・読み込みロジック (JSON)
@@ -29,17 +37,7 @@ def load_config():
     if os.path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                config = {}
-                config["start_date"] = datetime.datetime.strptime(data["start_date"], "%Y-%m-%d").date()
-                config["end_date"] = datetime.datetime.strptime(data["end_date"], "%Y-%m-%d").date()
-                
-                overrides = {}
-                for k, v in data.get("overrides", {}).items():
-                    d_key = datetime.datetime.strptime(k, "%Y-%m-%d").date()
-                    overrides[d_key] = v
-                config["overrides"] = overrides
-                return config
+                return parse_calendar_config(json.load(f))
         except Exception as e:
             st.error(f"設定読み込みエラー: {e}")
             return default_config
@@ -47,12 +45,9 @@ def load_config():
         return default_config
 
 def save_config(current_config):
-    """現在の設定をファイルに書き込む"""
-    save_data = {
-        "start_date": current_config["start_date"].strftime("%Y-%m-%d"),
-        "end_date": current_config["end_date"].strftime("%Y-%m-%d"),
-        "overrides": {k.strftime("%Y-%m-%d"): v for k, v in current_config["overrides"].items()}
-    }
+    """現在の設定をファイルに書き込む (カレンダーの版数も進める)"""
+    bump_calendar_version()
+    save_data = dump_calendar_config(current_config)
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(save_data, f, indent=4)
@@ -61,199 +56,141 @@ def save_config(current_config):
         st.error(f"保存エラー: {e}")
         return False
 
+def bump_calendar_version():
+    """期間・例外ルールが変わったことを知らせ、コンパイル済みカレンダーを作り直させる"""
+    st.session_state.calendar_version = st.session_state.get("calendar_version", 0) + 1
+
 # ==========================================
 # 2. カレンダー・ロジック設定
 # ==========================================
-def get_base_open_periods(date_obj):
-    m, d, w = date_obj.month, date_obj.day, date_obj.weekday()
-    if m == 1 and d in [1, 2, 3]: return []
-    if m == 12 and d == 31: return []
-    if w in [5, 6]: return [2, 3, 4, 5, 6]
-    return [4, 5, 6]
-
-def get_open_periods(date_obj):
-    overrides = st.session_state.calendar_config.get("overrides", {})
-    if date_obj in overrides:
-        return overrides[date_obj]
-    return get_base_open_periods(date_obj)
-
-def get_year_from_range(month, day, start_date, end_date):
-    curr = start_date
-    while curr <= end_date:
-        if curr.month == month and curr.day == day:
-            return curr.year
-        curr += datetime.timedelta(days=1)
-    return start_date.year
+def get_calendar_index():
+    """期間・例外ルールが変わったとき (版数が進んだとき) だけ作り直すコンパイル済みカレンダー"""
+    cfg = st.session_state.calendar_config
+    version = st.session_state.get("calendar_version", 0)
+    cal_index = st.session_state.get("calendar_index")
+    if cal_index is None or cal_index["version"] != version or \
+       (cal_index["start_date"], cal_index["end_date"]) != (cfg["start_date"], cfg["end_date"]):
+        cal_index = build_calendar_index(cfg["start_date"], cfg["end_date"], cfg.get("overrides", {}), version)
+        st.session_state.calendar_index = cal_index
+    return cal_index
 
-# ==========================================
-# 3. データ処理・計算ロジック
-# ==========================================
-def check_sufficiency(student_weekly_data, req_df):
-    warnings = []
-    student_reqs = {}
-    for _, row in req_df.iterrows():
-        name = row['生徒名']
-        total = sum(int(row.get(k, 0)) for k in ["国語", "数学", "英語", "理科", "社会"])
-        student_reqs[name] = total
-    student_avails = {name: 0 for name in student_reqs}
-    start_date = st.session_state.calendar_config["start_date"]
-    end_date = st.session_state.calendar_config["end_date"]
-    for s_name, weekly_data in student_weekly_data.items():
-        if s_name not in student_reqs: continue
-        count = 0
-        if not weekly_data: continue
-        for week_label, df in weekly_data.items():
-            for date_str in df.columns:
-                match = re.search(r"(\d+)/(\d+)", date_str)
-                if not match: continue
-                m, d = int(match.group(1)), int(match.group(2))
-                y = get_year_from_range(m, d, start_date, end_date)
-                try: d_date = datetime.date(y, m, d)
-                except: continue
-                open_periods = get_open_periods(d_date)
-                for p in range(1, 7):
-                    if p not in open_periods: continue
-                    try: val = str(df.loc[p, date_str])
-                    except: continue
-                    if any(x in val for x in ["〇", "○", "OK", "△", "▲", "1", "2", "3", "全"]):
-                        count += 1
-        student_avails[s_name] = count
-    for name, req_num in student_reqs.items():
-        avail_num = student_avails.get(name, 0)
-        if avail_num < req_num:
-            warnings.append(f"{name}：希望 {req_num}コマ > 空き {avail_num}コマ (不足確定: {req_num - avail_num})")
-    return warnings
-
-def calculate_schedule(teacher_weekly_data, req_df, student_weekly_data, teacher_name):
-    teacher_capacity = {}
-    start_date = st.session_state.calendar_config["start_date"]
-    end_date = st.session_state.calendar_config["end_date"]
-    for week_label, df in teacher_weekly_data.items():
-        for date_str in df.columns:
-            match = re.search(r"(\d+)/(\d+)", date_str)
-            if not match: continue
-            m, d = int(match.group(1)), int(match.group(2))
-            y = get_year_from_range(m, d, start_date, end_date)
-            try: d_date = datetime.date(y, m, d)
-            except: continue
-            open_periods = get_open_periods(d_date)
-            for p in range(1, 7):
-                try: val = str(df.loc[p, date_str])
-                except: continue
-                if p not in open_periods: continue
-                if any(x in val for x in ["〇", "○", "OK", "全"]):
-                    teacher_capacity[(d_date, p)] = 2
-                elif any(x in val for x in ["△", "▲", "半", "1"]):
-                    teacher_capacity[(d_date, p)] = 1
-    all_slots = []
-    for (d, p), cap in teacher_capacity.items():
-        all_slots.append((d, p, cap))
-    students = {}
-    for _, row in req_df.iterrows():
-        name = row['生徒名']
-        reqs = {k: int(row.get(k, 0)) for k in ["国語", "数学", "英語", "理科", "社会"]}
-        students[name] = {"reqs": reqs, "remaining": sum(reqs.values())}
-    student_availability = {}
-    for s_name, weekly_data in student_weekly_data.items():
-        if not weekly_data: continue
-        for week_label, df in weekly_data.items():
-            for date_str in df.columns:
-                match = re.search(r"(\d+)/(\d+)", date_str)
-                if not match: continue
-                m, d = int(match.group(1)), int(match.group(2))
-                y = get_year_from_range(m, d, start_date, end_date)
-                try: d_date = datetime.date(y, m, d)
-                except: continue
-                for p in range(1, 7):
-                    try: val = str(df.loc[p, date_str])
-                    except: continue
-                    if any(x in val for x in ["〇", "○", "OK", "△", "▲", "1", "2", "3", "全"]):
-                        student_availability[(s_name, d_date, p)] = True
-                    else:
-                        student_availability[(s_name, d_date, p)] = False
-    schedule_map = { (d, p): [] for d, p, cap in all_slots }
-    date_counts = Counter()
-    daily_student_counts = Counter()
-    random.seed(42)
-    max_loops = 3000
-    loop_count = 0
-    while loop_count < max_loops:
-        loop_count += 1
-        assigned_in_this_loop = False
-        def get_slot_priority(slot):
-            d, p, cap = slot
-            if len(schedule_map[(d, p)]) >= cap: return -99999
-            score = 0
-            if len(schedule_map.get((d, p-1), [])) > 0: score += 100
-            if len(schedule_map.get((d, p+1), [])) > 0: score += 100
-            score += date_counts[d] * 10
-            score += random.random()
-            return score
-        all_slots.sort(key=get_slot_priority, reverse=True)
-        for d, p, cap in all_slots:
-            current_assigned = schedule_map[(d, p)]
-            if len(current_assigned) >= cap: continue
-            candidates = []
-            for s_name, data in students.items():
-                if data["remaining"] <= 0: continue
-                if daily_student_counts[(s_name, d)] >= 3: continue
-                if not student_availability.get((s_name, d, p), False): continue
-                is_already_in = False
-                for entry in current_assigned:
-                    if entry.startswith(s_name + "("):
-                        is_already_in = True; break
-                if is_already_in: continue
-                candidates.append(s_name)
-            if not candidates: continue
-            candidates.sort(key=lambda x: (students[x]["remaining"], random.random()), reverse=True)
-            s = candidates[0]
-            items = sorted([(v, k) for k, v in students[s]["reqs"].items() if v > 0], reverse=True)
-            if not items: continue
-            subj = items[0][1]
-            students[s]["reqs"][subj] -= 1
-            students[s]["remaining"] -= 1
-            daily_student_counts[(s, d)] += 1
-            date_counts[d] += 1
-            schedule_map[(d, p)].append(f"{s}({subj})")
-            assigned_in_this_loop = True
-            break
-        if not assigned_in_this_loop: break
-    all_dates = sorted(list(set([x[0] for x in all_slots])))
-    unscheduled = []
-    for s, data in students.items():
-        for subj, cnt in data["reqs"].items():
-            if cnt > 0: unscheduled.append({"生徒名": s, "科目": subj, "不足": cnt})
-    return schedule_map, all_dates, unscheduled
+def get_shift_store():
+    """セッションのシフト (期間が変わっていたら日付をそろえ直したもの)"""
+    store = st.session_state.shift_store
+    if store is None: return None
+    aligned = align_shift_store(store, get_calendar_index())
+    if aligned is not store: st.session_state.shift_store = aligned
+    return aligned
+
+def get_sufficiency_counters():
+    """空きコマの集計。シフトが作り直されたとき・カレンダーが変わったときだけ全体を数え直す"""
+    store = get_shift_store()
+    version = get_calendar_index()["version"]
+    cached = st.session_state.get("sufficiency")
+    if cached is None or cached["store"] is not store or cached["version"] != version:
+        requested = requested_totals(st.session_state.student_req_df, store["student_names"])
+        cached = {"store": store, "version": version, "counters": new_sufficiency_counters(store, get_calendar_index(), requested)}
+        st.session_state.sufficiency = cached
+    return cached["counters"]
+
+def stash_week_edits(person, week, editor_key):
+    """表示中の週の未保存の編集 (data_editor の edited_rows) を週ごとの一時置き場に移す
+    (週を切り替えても消えないように)。移したあとは表の key を変え、一時置き場を反映した表を出し直す"""
+    edited_rows = st.session_state.get(editor_key, {}).get("edited_rows", {})
+    if not edited_rows: return
+    pending = st.session_state.pending_week_edits.setdefault((person, week["label"]), {"dates": week["dates"], "rows": {}})
+    for row, changes in edited_rows.items():
+        pending["rows"].setdefault(int(row), {}).update(changes)
+    st.session_state.week_edit_rev += 1
+
+def pending_week_df(df, person, label):
+    """一時置き場にある未保存の編集を、その週の表に重ねる"""
+    pending = st.session_state.pending_week_edits.get((person, label))
+    if not pending: return df
+    df = df.copy()
+    for row, changes in pending["rows"].items():
+        for col, value in changes.items():
+            if value is not None and col in df.columns: df.iat[row, df.columns.get_loc(col)] = value
+    return df
+
+def pending_week_labels(person):
+    """未保存の編集が残っている週"""
+    return [label for p, label in st.session_state.pending_week_edits if p == person]
+
+def save_week_edits(person, week, editor_key):
+    """フォームの保存ボタン用: 表示中の週と一時置き場の全週の編集を保存し、変更コマ数を残す"""
+    stash_week_edits(person, week, editor_key)
+    st.session_state.saved_edit_count = len(save_shift_edits(person))
+
+def save_shift_edits(person):
+    """一時置き場にある person の編集差分のセルだけを書き込み、変更履歴 (edit_journal) と空きコマの集計に反映する"""
+    store = get_shift_store()
+    cal_index = get_calendar_index()
+    counters = get_sufficiency_counters()
+    edits = []
+    for key in [key for key in st.session_state.pending_week_edits if key[0] == person]:
+        pending = st.session_state.pending_week_edits.pop(key)
+        # カレンダーの変更で期間外になった日は捨てる
+        dates = [d for d in pending["dates"] if d in cal_index["date_index"]]
+        edits.extend(shift_edits_from_editor(store, person, dates, pending["rows"], cal_index))
+    st.session_state.week_edit_rev += 1
+    apply_shift_edits(store, edits, cal_index)
+    update_sufficiency_shift(counters, store, edits, cal_index)
+    st.session_state.edit_journal.extend(edits)
+    return edits
+
+def save_student_requests(req_df):
+    """希望数表を保存し、空きコマの集計を直す"""
+    counters = get_sufficiency_counters()
+    st.session_state.student_req_df = req_df
+    store = get_shift_store()
+    update_sufficiency_requests(counters, store, requested_totals(req_df, store["student_names"]))
+
+def import_student_shifts(uploaded_file):
+    """生徒のシフト表 (Excel / CSV) を一括で読み込む。セル数が多いので変更履歴には残さず履歴を空にし、
+    次の差分修正では前回の可否との差から変わったセルを求める"""
+    report = import_availability(uploaded_file, uploaded_file.name, get_shift_store(), get_calendar_index())
+    st.session_state.edit_journal = []
+    st.session_state.pending_week_edits = {}
+    if st.session_state.schedule_run is not None: st.session_state.schedule_run["journal_pos"] = None
+    if st.session_state.solve_job is not None: st.session_state.solve_job["journal_pos"] = None
+    st.session_state.sufficiency = None
+    return report
+
+def journal_changed_cells(edits, student_names):
+    """変更履歴を repair_schedule の changed_cells (人の番号, 日付番号, 講 - 1) にする"""
+    date_index = get_calendar_index()["date_index"]
+    person_of = {name: 1 + i for i, name in enumerate(student_names)}
+    cells = []
+    for e in edits:
+        person = 0 if e["name"] is None else person_of.get(e["name"])
+        if person is not None and e["date"] in date_index: cells.append((person, date_index[e["date"]], e["period"] - 1))
+    return cells
 
 # ==========================================
-# 4. UIヘルパー関数
+# 3. UIヘルパー関数
 # ==========================================
-def get_week_ranges():
-    start_date = st.session_state.calendar_config["start_date"]
-    end_date = st.session_state.calendar_config["end_date"]
-    weeks = []
-    current_dates = []
-    curr = start_date
-    while curr <= end_date:
-        current_dates.append(curr)
-        if len(current_dates) == 7 or curr == end_date:
-            label = f"{current_dates[0].strftime('%m/%d')} 〜 {current_dates[-1].strftime('%m/%d')}"
-            weeks.append({"label": label, "dates": current_dates})
-            current_dates = []
-        curr += datetime.timedelta(days=1)
-    return weeks
-
-def create_weekly_df(dates):
-    col_names = [d.strftime("%m/%d(%a)") for d in dates]
-    data = {}
-    for d_obj, col in zip(dates, col_names):
-        open_periods = get_open_periods(d_obj)
-        col_data = []
-        for p in range(1, 7):
-            val = "〇" if p in open_periods else "×"
-            col_data.append(val)
-        data[col] = col_data
-    return pd.DataFrame(data, index=[1, 2, 3, 4, 5, 6])
+SOLVER_MODES = {
+    "greedy": "高速 (貪欲法)",
+    "flow": "最大配置 (最小費用流)",
+    "multi": "複数シード (並列)",
+    "repair": "差分修正 (前回の結果を保つ)"
+}
+
+SHIFT_OPTIONS_TEACHER = ("〇", "×", "△")
+SHIFT_OPTIONS_STUDENT = ("〇", "×")
+
+# ページのスクリプトは再実行のたびに新しいモジュールとして読み直されるので、関数に付けた lru_cache は残らない。
+# st.cache_resource はスクリプトの外に置かれるので再実行をまたいで使い回せる (data_editor は列設定を複製してから使う)
+@st.cache_resource(max_entries=256, show_spinner=False)
+def get_week_column_config(col_names, options):
+    """週ごとの列設定 (同じ列・同じ選択肢なら再実行のたびに作り直さない)"""
+    return {col: st.column_config.SelectboxColumn(col, options=list(options), width="small", required=True) for col in col_names}
+
+def select_week(weeks, key):
+    """編集する週を選ぶ (表示するのは選んだ1週間分の表だけ)"""
+    week_idx = st.selectbox("表示する週", range(len(weeks)), format_func=lambda i: f"{weeks[i]['label']} ({i + 1}/{len(weeks)}週目)", key=key)
+    return weeks[week_idx]
 
 def create_student_req_df(student_names):
     data = []
@@ -261,22 +198,196 @@ def create_student_req_df(student_names):
         data.append({"生徒名": name, "国語": 0, "数学": 0, "英語": 0, "理科": 0, "社会": 0})
     return pd.DataFrame(data)
 
+def show_sufficiency_dashboard():
+    """保存した直後の空きコマの状況 (集計を読むだけで、シフト全体は数え直さない)"""
+    summary = sufficiency_summary(get_sufficiency_counters(), get_shift_store()["student_names"])
+    with st.expander("📊 空きコマの状況", expanded=bool(summary["at_risk"])):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("希望コマ数 (合計)", summary["requested"])
+        col2.metric("コーチの受け入れ枠", summary["seats"], delta=summary["seats"] - summary["requested"], help="差は希望コマ数に対する残りの枠")
+        col3.metric("入れられる上限", summary["max_total"], delta=summary["max_total"] - summary["requested"],
+                    help="コーチの受け入れ人数・生徒の行けるコマ・1日3コマまでから求めた上限 (これより多くは入りません)")
+        if summary["at_risk"]:
+            st.warning(f"希望数に対して空きコマが足りない生徒: {len(summary['at_risk'])}人")
+            st.dataframe(pd.DataFrame([{"生徒名": name, "希望": req, "上限": bound, "不足": req - bound} for name, req, bound in summary["at_risk"]]),
+                         hide_index=True, width='stretch')
+        else:
+            st.success("どの生徒も、希望数に対して空きコマは足りています")
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def get_preview_column_config(col_names):
+    """プレビューの列設定 (get_week_column_config と同じく再実行をまたいで使い回す)"""
+    return {col: st.column_config.TextColumn(col, width="medium") for col in col_names}
+
+def show_schedule_result(run, profile=None):
+    """計算結果 (st.session_state.schedule_run) の表示。profile を渡すとプレビュー作成の時間も測る"""
+    result = run["result"]
+    if run["warnings"]:
+        st.warning("⚠️ 【注意】空きコマ不足の生徒がいます")
+        for w in run["warnings"]: st.write(f"- {w}")
+        st.divider()
+    if run["cancelled"]:
+        st.warning("⏹ 計算を中止したため、途中までの時間割を表示しています")
+    else:
+        st.success("✅ 完成しました！")
+    if run["cache_hit"]:
+        st.caption("前回と同じ条件だったため、保存済みの計算結果を表示しています")
+    if "max_placeable" in result and not run["cancelled"]:
+        st.caption(f"配置できる授業数の上限: {result['max_placeable']}コマ (この配置はその上限に達しています)")
+    if "starts_finished" in result:
+        st.caption(f"{result['starts_requested']}通り中 {result['starts_finished']}通りを試し、シード {result['seed']} の結果を採用しました")
+    if "repair" in result:
+        st.caption(f"差分修正: {result['repair']['students']}人の授業を見直し、{result['repair']['removed']}コマを外して"
+                   f"{result['repair']['added']}コマを入れ直しました (ほかの生徒の授業は動かしていません)")
+    if "local_search" in result:
+        st.caption(f"局所探索: {result['local_search']['iterations']:,}回試行 (評価値 +{result['local_search']['gain']})")
+    view = run["view"]
+    tab_week, tab_student = st.tabs(["📅 週ごと", "🙋 生徒別"])
+    with tab_week:
+        st.subheader("📅 完成時間割プレビュー")
+        with phase(profile, "プレビュー作成"):
+            grid_text = schedule_grid_text(view, ", ")
+            day_labels = view["day_labels"]
+            period_labels = [f"{p}講" for p in range(1, 7)]
+            for i in range(0, len(day_labels), 7):
+                col_names = day_labels[i : i+7]
+                col_config = get_preview_column_config(tuple(col_names))
+                df_week_view = pd.DataFrame(grid_text[i : i+7].T, columns=col_names, index=period_labels)
+                st.write(f"**{view['dates'][i].strftime('%Y/%m/%d')} 週**")
+                # 色指定を削除し、通常のデータフレーム表示に戻しました
+                st.dataframe(df_week_view, column_config=col_config, width='stretch')
+    with tab_student:
+        names = view["student_names"]
+        s_idx = st.selectbox("生徒を選択", range(len(names)), format_func=names.__getitem__, key="result_student")
+        if s_idx is not None:
+            rows = student_timetable(view, s_idx)
+            st.caption(f"{names[s_idx]}: 全{len(view['by_student'][s_idx])}コマ")
+            if rows:
+                df_student = pd.DataFrame([cells for _, cells in rows], index=[label for label, _ in rows], columns=[f"{p}講" for p in range(1, 7)])
+                st.dataframe(df_student, width='stretch')
+            else:
+                st.info("授業が入っていません")
+
+    unscheduled = view["unscheduled"]
+    if unscheduled:
+        st.error("⚠️ 入りきらなかった授業")
+        st.dataframe(pd.DataFrame(unscheduled), hide_index=True)
+    else:
+        st.info("🎉 全て完了！")
+
+    extra_sheets = st.multiselect("Excel に追加するシート", list(EXCEL_EXTRA_SHEETS), format_func=EXCEL_EXTRA_SHEETS.get, key="excel_extra_sheets")
+    def build_excel():
+        # ボタンが押されたときだけ (別スレッドで) 作る。同じ結果・同じシート構成なら作り直さない
+        # 計算の記録 (run["profile"]) はもうログに書いてあるので、出力の時間は出力ごとに別の行として記録する
+        if run["profile"] is None:
+            return cached_schedule_excel(run["key"], result, run["cal_index"], tuple(extra_sheets), view)
+        export_profile = new_profile(memory=run["profile"]["memory"])
+        with phase(export_profile, "Excel出力"):
+            data = cached_schedule_excel(run["key"], result, run["cal_index"], tuple(extra_sheets), view)
+        export_profile["counters"].update(bytes=len(data), extra_sheets=list(extra_sheets))
+        append_profile_log(export_profile, PROFILE_LOG_FILE, teacher=run["teacher_name"], mode=run["mode"], event="Excel出力")
+        return data
+    st.download_button(label="📥 Excel保存", data=build_excel, file_name=f"完成時間割_{run['teacher_name']}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    if run["profile"] is not None:
+        with st.expander("⏱ パフォーマンス"):
+            st.dataframe(pd.DataFrame(run["profile"]["phases"]), hide_index=True)
+            st.caption(f"Excel出力の時間はここには含めず、出力するたびに {PROFILE_LOG_FILE} へ別の行で記録します")
+            counters = run["profile"]["counters"]
+            if "loop_count" in counters:
+                st.caption(f"ループ回数 {counters['loop_count']:,} / 上限 {counters['max_loops']:,}、"
+                           f"スコア計算 {counters['slots_scored']:,}コマ、候補の生徒 {counters['candidates_examined']:,}人")
+            st.json(counters, expanded=False)
+
+def solve_in_background(job, ctx):
+    """別スレッドで実行する計算 (st.session_state には触らない)。中止されたら途中までの時間割を返す"""
+    avail, reqs, profile = ctx["avail"], ctx["reqs"], ctx["profile"]
+    mode = ctx["mode"]
+    with phase(profile, "コマ割り計算"):
+        on_progress = job_reporter(job, "コマ割り計算")
+        if mode == "flow":
+            result = solve_flow(avail, reqs, on_progress=on_progress)
+        elif mode == "multi":
+            result = solve_multi_start(avail, reqs, n_starts=ctx["n_starts"], time_budget=ctx["time_budget"], on_progress=on_progress)
+        elif mode == "repair":
+            result = repair_schedule(avail, ctx["prev_result"], reqs, prev_codes=ctx["prev_codes"], changed_cells=ctx["changed_cells"])
+        else:
+            result = solve_greedy(avail, reqs, on_progress=on_progress)
+    if ctx["local_search"] > 0:
+        # 局所探索を始める前に中止されたときは、局所探索を飛ばした途中までの結果になる
+        if job["cancel"].is_set(): job["stopped"] = True
+        if not job["stopped"]:
+            with phase(profile, "局所探索"):
+                result = improve_schedule(avail, result, time_budget=ctx["local_search"], on_progress=job_reporter(job, "局所探索"))
+    # 途中で打ち切った結果は条件どおりの計算ではないので、キャッシュに入れない
+    if ctx["key"] is not None and not job["stopped"]: put_cached_result(ctx["key"], result)
+    return result
+
+def store_schedule_run(ctx, result, cache_hit, cancelled=False):
+    """計算結果から表示用データを作り、st.session_state.schedule_run に入れる
+    中止した計算は同じ条件の計算と区別できるよう key を None にする (結果・Excel のキャッシュを使わない)"""
+    profile = ctx["profile"]
+    record_solver_counters(profile, result)
+    if profile is not None: profile["counters"]["cache_hit"] = cache_hit
+    with phase(profile, "表示用データ作成"):
+        view = build_schedule_view(result, ctx["cal_index"])
+    st.session_state.schedule_run = {
+        "key": None if cancelled else ctx["key"],
+        "cache_hit": cache_hit,
+        "cancelled": cancelled,
+        "result": result,
+        "avail_codes": ctx["avail"]["codes"],
+        "journal_pos": ctx["journal_pos"],
+        "view": view,
+        "warnings": ctx["warnings"],
+        "cal_index": ctx["cal_index"],
+        "teacher_name": ctx["teacher_name"],
+        "mode": ctx["mode"],
+        "profile": profile
+    }
+
+def cancel_solve_job():
+    """実行中の計算を止めて捨てる (リセット・読み込みのとき)"""
+    ctx = st.session_state.get("solve_job")
+    if ctx is not None: ctx["job"]["cancel"].set()
+    st.session_state.solve_job = None
+
+@st.fragment(run_every=0.5)
+def show_solve_progress():
+    """別スレッドの計算の進み具合 (この部分だけ 0.5 秒ごとに再実行する)。終わったらアプリ全体を再実行して結果を出す"""
+    ctx = st.session_state.get("solve_job")
+    if ctx is None: return
+    job = ctx["job"]
+    if job["done"]: st.rerun()
+    text = f"{job['stage']}中... {job['placed']}/{job['requested']}コマ ({time.monotonic() - job['started']:.0f}秒)"
+    score = job["best_score"]
+    if isinstance(score, tuple): text += f" 最良: 入りきらない授業 {score[0]}コマ・連続コマ {-score[1]}組"
+    elif score is not None: text += f" 評価値 +{score}"
+    st.progress(min(job["placed"] / job["requested"], 1.0) if job["requested"] else 0.0, text=text)
+    if st.button("⏹ 中止して途中までの結果を使う", disabled=job["cancel"].is_set()):
+        job["cancel"].set()
+
 # ==========================================
-# 5. メインアプリ (Streamlit)
+# 4. メインアプリ (Streamlit)
 # ==========================================
 st.set_page_config(page_title="時間割作成 ", layout="wide")
 st.title(" 個別指導塾 時間割作成")
 
 if "calendar_config" not in st.session_state:
     st.session_state.calendar_config = load_config()
+if "calendar_version" not in st.session_state: st.session_state.calendar_version = 0
 
-if "teacher_weekly_data" not in st.session_state: st.session_state.teacher_weekly_data = None
+if "shift_store" not in st.session_state: st.session_state.shift_store = None
 if "student_req_df" not in st.session_state: st.session_state.student_req_df = None
-if "student_weekly_data" not in st.session_state: st.session_state.student_weekly_data = {}
 if "student_list" not in st.session_state: st.session_state.student_list = []
 if "teacher_name_default" not in st.session_state: st.session_state.teacher_name_default = "佐藤"
+if "schedule_run" not in st.session_state: st.session_state.schedule_run = None
+if "edit_journal" not in st.session_state: st.session_state.edit_journal = []
+if "solve_job" not in st.session_state: st.session_state.solve_job = None
+if "pending_week_edits" not in st.session_state: st.session_state.pending_week_edits = {}
+if "week_edit_rev" not in st.session_state: st.session_state.week_edit_rev = 0
 
-weeks_info = get_week_ranges()
+weeks_info = get_week_ranges(get_calendar_index())
 
 # --- サイドバー ---
 with st.sidebar:
@@ -292,16 +403,12 @@ with st.sidebar:
         st.session_state.student_list = new_list
         st.session_state.teacher_name_default = teacher_name
         
-        t_data = {}
-        for w in weeks_info: t_data[w["label"]] = create_weekly_df(w["dates"])
-        st.session_state.teacher_weekly_data = t_data
+        st.session_state.shift_store = new_shift_store(get_calendar_index(), new_list)
         st.session_state.student_req_df = create_student_req_df(new_list)
-        s_data_all = {}
-        for s in new_list:
-            s_weeks = {}
-            for w in weeks_info: s_weeks[w["label"]] = create_weekly_df(w["dates"])
-            s_data_all[s] = s_weeks
-        st.session_state.student_weekly_data = s_data_all
+        st.session_state.schedule_run = None
+        st.session_state.edit_journal = []
+        st.session_state.pending_week_edits = {}
+        cancel_solve_job()
         st.success("リセットしました。")
 
     # 管理者設定
@@ -331,7 +438,7 @@ with st.sidebar:
             st.divider()
             st.write("**例外ルールの追加（特定日の変更）**")
             ex_date = st.date_input("日付を選択", new_start)
-            current_periods = get_open_periods(ex_date)
+            current_periods = get_open_periods(ex_date, st.session_state.calendar_config.get("overrides", {}))
             st.caption(f"現在の設定: {current_periods if current_periods else '全休'}")
             
             st.write("開講するコマを選択:")
@@ -359,45 +466,48 @@ with st.sidebar:
     # 個人データ保存
     st.divider()
     st.subheader("💾 データの保存・復元")
-    if st.session_state.teacher_weekly_data is not None:
+    if st.session_state.shift_store is not None:
         export_data = {
             "teacher_name": teacher_name,
             "student_list": st.session_state.student_list,
-            "teacher_weekly_data": st.session_state.teacher_weekly_data,
+            "shift_store": get_shift_store(),
             "student_req_df": st.session_state.student_req_df,
-            "student_weekly_data": st.session_state.student_weekly_data,
             "calendar_config": st.session_state.calendar_config
         }
         try:
-            pickle_byte = pickle.dumps(export_data)
             st.download_button(
-                label="📥 データを保存 (.pkl)",
-                data=pickle_byte,
-                file_name=f"schedule_data_{datetime.date.today()}.pkl",
-                mime="application/octet-stream"
+                label="📥 データを保存 (.zip)",
+                data=encode_save_data(export_data),
+                file_name=f"schedule_data_{datetime.date.today()}.zip",
+                mime="application/zip"
             )
         except Exception as e:
             st.error(f"保存準備エラー: {e}")
     
-    uploaded_file = st.file_uploader("📤 データを読み込む", type=["pkl"])
-    if uploaded_file is not None:
+    uploaded_file = st.file_uploader("📤 データを読み込む", type=["zip", "pkl"], help=".pkl は以前の形式です")
+    # 同じファイルを再実行のたびに読み直さない
+    if uploaded_file is not None and getattr(uploaded_file, "file_id", uploaded_file.name) != st.session_state.get("loaded_file_id"):
         try:
-            loaded_data = pickle.load(uploaded_file)
-            st.session_state.student_list = loaded_data.get("student_list", [])
-            st.session_state.teacher_weekly_data = loaded_data.get("teacher_weekly_data", None)
-            st.session_state.student_req_df = loaded_data.get("student_req_df", None)
-            st.session_state.student_weekly_data = loaded_data.get("student_weekly_data", {})
-            if "teacher_name" in loaded_data:
+            loaded_data = read_save_file(uploaded_file, st.session_state.calendar_config)
+            st.session_state.loaded_file_id = getattr(uploaded_file, "file_id", uploaded_file.name)
+            st.session_state.student_list = loaded_data["student_list"]
+            st.session_state.student_req_df = loaded_data["student_req_df"]
+            st.session_state.schedule_run = None
+            st.session_state.edit_journal = []
+            st.session_state.pending_week_edits = {}
+            cancel_solve_job()
+            if loaded_data["teacher_name"]:
                 st.session_state.teacher_name_default = loaded_data["teacher_name"]
-            if "calendar_config" in loaded_data:
-                st.session_state.calendar_config = loaded_data["calendar_config"]
+            st.session_state.calendar_config = loaded_data["calendar_config"]
+            bump_calendar_version()
+            st.session_state.shift_store = align_shift_store(loaded_data["shift_store"], get_calendar_index())
             st.success("復元完了！")
             st.rerun()
         except Exception as e:
             st.error(f"読み込み失敗: {e}")
 
 # --- メインエリア ---
-if st.session_state.teacher_weekly_data is None:
+if st.session_state.shift_store is None:
     st.info("👈 生徒名を入力して「入力を開始」を押してください。")
 else:
     tab1, tab2, tab3, tab4 = st.tabs(["📅 コーチシフト", "🔢 生徒希望数", "🙋‍♂️ 生徒シフト", "🚀 作成＆結果"])
@@ -405,24 +515,21 @@ else:
     with tab1:
         st.subheader(f"{teacher_name}コーチの予定")
         st.caption("「〇」=両配ok、「△」＝片配ok、「×」＝入れない")
-        st.info("💡 入力後に必ず「保存」を押してください。")
+        st.info("💡 週を選んで「週を切り替える」を押すと、表示中の週の入力は保存するまで残ります。")
         with st.form("teacher_form"):
-            updated_weekly_data = {}
-            for w in weeks_info:
-                label = w["label"]
-                st.write(f"**{label}**")
-                original_df = st.session_state.teacher_weekly_data.get(label)
-                if original_df is None: original_df = create_weekly_df(w["dates"])
-                column_config = {}
-                options = ["〇", "×", "△"]
-                for col in original_df.columns:
-                    column_config[col] = st.column_config.SelectboxColumn(col, options=options, width="small", required=True)
-                edited_df = st.data_editor(original_df, column_config=column_config, width='stretch', key=f"teacher_edit_{label}", height=300)
-                updated_weekly_data[label] = edited_df
-                st.divider()
-            if st.form_submit_button("💾 入力内容を保存する", type="primary"):
-                st.session_state.teacher_weekly_data = updated_weekly_data
-                st.success("保存しました！")
+            week = select_week(weeks_info, "teacher_week")
+            store = get_shift_store()
+            label = week["label"]
+            st.write(f"**{label}**")
+            original_df = pending_week_df(shift_week_df(store, 0, week["dates"], get_calendar_index()), 0, label)
+            column_config = get_week_column_config(tuple(original_df.columns), SHIFT_OPTIONS_TEACHER)
+            editor_key = f"teacher_edit_{label}_{st.session_state.week_edit_rev}"
+            edited_df = st.data_editor(original_df, column_config=column_config, width='stretch', key=editor_key, height=300)
+            if pending_week_labels(0): st.caption("未保存の週: " + "、".join(pending_week_labels(0)))
+            col_w1, col_w2 = st.columns(2)
+            col_w1.form_submit_button("🔁 週を切り替える", on_click=stash_week_edits, args=(0, week, editor_key))
+            if col_w2.form_submit_button("💾 入力内容を保存する", type="primary", on_click=save_week_edits, args=(0, week, editor_key)):
+                st.success(f"保存しました！ ({st.session_state.saved_edit_count}コマ変更)")
 
     with tab2:
         st.subheader("各教科の必要コマ数")
@@ -430,112 +537,142 @@ else:
         with st.form("req_form"):
             edited_req_df = st.data_editor(st.session_state.student_req_df, hide_index=True, width='stretch')
             if st.form_submit_button("💾 希望数を保存する", type="primary"):
-                st.session_state.student_req_df = edited_req_df
+                save_student_requests(edited_req_df)
                 st.success("保存しました！")
+        show_sufficiency_dashboard()
 
     with tab3:
         st.subheader("生徒の行ける日時")
+        with st.expander("📥 Excel / CSV からまとめて読み込む"):
+            st.caption("生徒ごとのシート (シート名が生徒名、見出し行に日付、1列目に講) か、「生徒名・日付・講・可否」の一覧表 (CSV はこの形式) を読み込みます。空欄は「×」になります")
+            bulk_file = st.file_uploader("シフト表 (.xlsx / .csv)", type=["xlsx", "csv"], key="bulk_shift_file")
+            if bulk_file is not None and st.button("📥 読み込む", key="bulk_shift_import"):
+                try:
+                    report = import_student_shifts(bulk_file)
+                    st.success(f"{report['students']}人・{report['cells']:,}コマを読み込みました ({report['changed']:,}コマ変更)")
+                    if report["error_counts"]:
+                        st.warning("読み込めなかったセル: " + "、".join(f"{reason} {n:,}件" for reason, n in report["error_counts"].items()))
+                        st.dataframe(pd.DataFrame(report["errors"]), hide_index=True)
+                except Exception as e:
+                    st.error(f"読み込み失敗: {e}")
         target_student = st.selectbox("生徒を選択", st.session_state.student_list)
-        if target_student:
+        store = get_shift_store()
+        person = shift_person_index(store, target_student) if target_student else None
+        if target_student and person is None:
+            st.warning(f"{target_student} のシフトがありません。「入力を開始/リセット」を押してください。")
+        elif target_student:
             st.caption(f"{target_student} の行ける時間")
-            st.info("💡 入力後に必ず「保存」を押してください。")
+            st.info("💡 週を選んで「週を切り替える」を押すと、表示中の週の入力は保存するまで残ります。生徒を切り替える前には「保存」を押してください。")
             with st.form(f"student_form_{target_student}"):
-                updated_s_weekly = {}
-                for w in weeks_info:
-                    label = w["label"]
-                    st.write(f"**{label}**")
-                    s_data_map = st.session_state.student_weekly_data.get(target_student, {})
-                    s_df = s_data_map.get(label)
-                    if s_df is None: s_df = create_weekly_df(w["dates"])
-                    column_config_s = {}
-                    options = ["〇", "×"]
-                    for col in s_df.columns:
-                        column_config_s[col] = st.column_config.SelectboxColumn(col, options=options, width="small", required=True)
-                    edited_s_df = st.data_editor(s_df, column_config=column_config_s, width='stretch', key=f"student_edit_{target_student}_{label}", height=300)
-                    
-                    updated_s_weekly[label] = edited_s_df
-                    st.divider()
-                if st.form_submit_button(f"💾 {target_student} のシフトを保存する", type="primary"):
-                    st.session_state.student_weekly_data[target_student] = updated_s_weekly
-                    st.success("保存しました！")
+                week = select_week(weeks_info, "student_week")
+                label = week["label"]
+                st.write(f"**{label}**")
+                s_df = pending_week_df(shift_week_df(store, person, week["dates"], get_calendar_index()), person, label)
+                column_config_s = get_week_column_config(tuple(s_df.columns), SHIFT_OPTIONS_STUDENT)
+                editor_key = f"student_edit_{target_student}_{label}_{st.session_state.week_edit_rev}"
+                edited_s_df = st.data_editor(s_df, column_config=column_config_s, width='stretch', key=editor_key, height=300)
+                if pending_week_labels(person): st.caption("未保存の週: " + "、".join(pending_week_labels(person)))
+                col_w1, col_w2 = st.columns(2)
+                col_w1.form_submit_button("🔁 週を切り替える", on_click=stash_week_edits, args=(person, week, editor_key))
+                if col_w2.form_submit_button(f"💾 {target_student} のシフトを保存する", type="primary", on_click=save_week_edits, args=(person, week, editor_key)):
+                    st.success(f"保存しました！ ({st.session_state.saved_edit_count}コマ変更)")
+        show_sufficiency_dashboard()
 
     with tab4:
         st.subheader("時間割作成")
-        if st.button("🚀 作成スタート", type="primary"):
-            warnings = check_sufficiency(st.session_state.student_weekly_data, st.session_state.student_req_df)
-            if warnings:
-                st.warning("⚠️ 【注意】空きコマ不足の生徒がいます")
-                for w in warnings: st.write(f"- {w}")
-                st.divider()
-            with st.spinner("計算中..."):
+        solver_mode = st.radio("計算方式", list(SOLVER_MODES.keys()), format_func=SOLVER_MODES.get, horizontal=True,
+                               help="「最大配置」は入れられる授業数が最大になる配置を求めます (生徒数が多いと時間がかかります)。「差分修正」はシフトや希望数を直したあと、前回の時間割のうち成り立たなくなった授業だけを入れ直します")
+        if solver_mode == "multi":
+            col_m1, col_m2 = st.columns(2)
+            n_starts = col_m1.slider("試行回数", 2, 64, 16, help="優先度の付け方を変えて何通り試すか")
+            time_budget = col_m2.number_input("制限時間 (秒)", 1, 300, 10)
+        col_l1, col_l2 = st.columns(2)
+        use_local_search = col_l1.checkbox("局所探索で仕上げる", help="作成後に授業の移動・入れ替えを試し、入りきらない授業や空きコマを減らします")
+        local_search_budget = col_l2.slider("仕上げに使う時間 (秒)", 1, 30, 3, disabled=not use_local_search)
+        col_p1, col_p2 = st.columns(2)
+        use_profile = col_p1.checkbox("処理時間を計測する", help=f"段階ごとの処理時間を表示し、{PROFILE_LOG_FILE} に記録します")
+        profile_memory = col_p2.checkbox("メモリ使用量も計測する (遅くなります)", disabled=not use_profile)
+        if st.session_state.schedule_run is not None and st.session_state.schedule_run["journal_pos"] is None:
+            st.caption("📝 前回の計算以降にシフトを一括で読み込んだため、変更の一覧はありません (差分修正では前回の可否との差から求めます)")
+        elif st.session_state.schedule_run is not None:
+            pending = st.session_state.edit_journal[st.session_state.schedule_run["journal_pos"]:]
+            if pending:
+                with st.expander(f"📝 前回の計算以降のシフト変更 ({len(pending)}コマ)"):
+                    st.dataframe(pd.DataFrame([{
+                        "名前": e["name"] or f"{teacher_name}コーチ",
+                        "日付": e["date"].strftime("%m/%d(%a)"),
+                        "講": e["period"],
+                        "変更前": e["old"],
+                        "変更後": e["new"]
+                    } for e in pending]), hide_index=True)
+        solved_now = False
+        # 終わった計算は作成ボタンを描く前に取り込む (ボタンが押せないまま残らないように)
+        ctx = st.session_state.solve_job
+        if ctx is not None and ctx["job"]["done"]:
+            job = ctx["job"]
+            st.session_state.solve_job = None
+            if job["error"] is not None:
+                st.session_state.schedule_run = None
+                st.error(f"エラー: {job['error']}")
+            else:
                 try:
-                    schedule_map, all_dates, unscheduled = calculate_schedule(
-                        st.session_state.teacher_weekly_data,
-                        st.session_state.student_req_df,
-                        st.session_state.student_weekly_data,
-                        teacher_name
-                    )
-                    st.success("✅ 完成しました！")
-                    st.subheader("📅 完成時間割プレビュー")
-                    
-                    cal_dates = []
-                    curr = st.session_state.calendar_config["start_date"]
-                    end = st.session_state.calendar_config["end_date"]
-                    while curr <= end:
-                        cal_dates.append(curr)
-                        curr += datetime.timedelta(days=1)
-
-                    for i in range(0, len(cal_dates), 7):
-                        week_dates = cal_dates[i : i+7]
-                        week_data = {}
-                        col_names = [d.strftime("%m/%d(%a)") for d in week_dates]
-                        col_config = {}
-                        for d_obj, col in zip(week_dates, col_names):
-                            col_config[col] = st.column_config.TextColumn(col, width="medium")
-                            col_content = []
-                            for p in range(1, 7):
-                                assigned = schedule_map.get((d_obj, p), [])
-                                if assigned:
-                                    col_content.append(", ".join(assigned))
-                                else:
-                                    open_periods = get_open_periods(d_obj)
-                                    col_content.append("-" if p in open_periods else "×")
-                            week_data[col] = col_content
-                        df_week_view = pd.DataFrame(week_data, index=[f"{p}講" for p in range(1, 7)])
-                        st.write(f"**{week_dates[0].strftime('%Y/%m/%d')} 週**")
-                        # 色指定を削除し、通常のデータフレーム表示に戻しました
-                        st.dataframe(df_week_view, column_config=col_config, width='stretch')
-                        
-
-                    if unscheduled:
-                        st.error("⚠️ 入りきらなかった授業")
-                        st.dataframe(pd.DataFrame(unscheduled), hide_index=True)
-                    else:
-                        st.info("🎉 全て完了！")
-
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                        workbook = writer.book
-                        worksheet = workbook.add_worksheet("時間割")
-                        writer.sheets["時間割"] = worksheet
-                        wrap_fmt = workbook.add_format({'text_wrap': True, 'valign': 'top', 'border': 1, 'align': 'center'})
-                        header_fmt = workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'border': 1, 'align': 'center'})
-                        current_row = 0
-                        for i in range(0, len(cal_dates), 7):
-                            week_dates = cal_dates[i : i+7]
-                            worksheet.write(current_row, 0, "講", header_fmt)
-                            for col_idx, d_obj in enumerate(week_dates):
-                                worksheet.write(current_row, col_idx + 1, d_obj.strftime("%m/%d(%a)"), header_fmt)
-                            for p in range(1, 7):
-                                row_idx = current_row + p
-                                worksheet.write(row_idx, 0, p, wrap_fmt)
-                                for col_idx, d_obj in enumerate(week_dates):
-                                    assigned = schedule_map.get((d_obj, p), [])
-                                    cell_text = "\n".join(assigned) if assigned else ("" if p in get_open_periods(d_obj) else "×")
-                                    worksheet.write(row_idx, col_idx + 1, cell_text, wrap_fmt)
-                            current_row += 8
-                        worksheet.set_column(0, 0, 5); worksheet.set_column(1, 7, 18)
-                        if unscheduled: pd.DataFrame(unscheduled).to_excel(writer, sheet_name="未消化リスト", index=False)
-                    st.download_button(label="📥 Excel保存", data=output.getvalue(), file_name=f"完成時間割_{teacher_name}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                    store_schedule_run(ctx, job["result"], cache_hit=False, cancelled=job["stopped"])
+                    solved_now = True
                 except Exception as e:
-                    st.error(f"エラー: {e}")
\ No newline at end of file
+                    st.session_state.schedule_run = None
+                    st.error(f"エラー: {e}")
+        running = st.session_state.solve_job is not None
+        if st.button("🚀 作成スタート", type="primary", disabled=running):
+            profile = new_profile(memory=profile_memory) if use_profile else None
+            with phase(profile, "シフト表の読み込み"):
+                avail = shift_store_avail(
+                    get_shift_store(),
+                    get_calendar_index(),
+                    get_student_names(st.session_state.student_req_df)
+                )
+            with phase(profile, "空きコマ不足チェック"):
+                warnings = check_sufficiency(avail, st.session_state.student_req_df)
+            try:
+                reqs = get_requirements(st.session_state.student_req_df, avail["student_names"])
+                options = {"mode": solver_mode, "local_search": local_search_budget if use_local_search else 0}
+                if solver_mode == "multi": options.update(n_starts=n_starts, time_budget=time_budget)
+                prev_run = st.session_state.schedule_run
+                if solver_mode == "repair":
+                    if prev_run is None: raise ValueError("差分修正の前に、ほかの計算方式で一度時間割を作ってください")
+                    options["base"] = prev_run["key"]
+                # 計算中にシフトを編集してもよいように、計算に使う条件はここで固定する
+                # 中止した計算 (key が None) を土台にした差分修正も、キャッシュを使わない
+                key = None if solver_mode == "repair" and prev_run["key"] is None else schedule_fingerprint(avail, reqs, **options)
+                ctx = dict(options, avail=avail, reqs=reqs, warnings=warnings, profile=profile, teacher_name=teacher_name,
+                           key=key, cal_index=get_calendar_index(), journal_pos=len(st.session_state.edit_journal))
+                if solver_mode == "repair":
+                    # 一括読み込みのあとは履歴がないので、前回の可否との差分から求める (changed_cells=None)
+                    changed_cells = None
+                    if prev_run["journal_pos"] is not None:
+                        edits = st.session_state.edit_journal[prev_run["journal_pos"]:]
+                        changed_cells = journal_changed_cells(edits, avail["student_names"])
+                    ctx.update(prev_result=prev_run["result"], prev_codes=prev_run["avail_codes"], changed_cells=changed_cells)
+                result = get_cached_result(key) if key is not None else None
+                if result is not None:
+                    store_schedule_run(ctx, result, cache_hit=True)
+                    solved_now = True
+                else:
+                    job = new_solve_job(sum(r for r in reqs if r > 0))
+                    start_solve_job(job, lambda job: solve_in_background(job, ctx))
+                    st.session_state.solve_job = dict(ctx, job=job)
+            except Exception as e:
+                st.session_state.schedule_run = None
+                st.error(f"エラー: {e}")
+
+        if st.session_state.solve_job is not None: show_solve_progress()
+
+        # 直前の計算結果は再実行 (他のウィジェット操作) のあとも表示し続ける
+        run = st.session_state.get("schedule_run")
+        if run is not None:
+            try:
+                show_schedule_result(run, run["profile"] if solved_now else None)
+                if solved_now and run["profile"] is not None:
+                    append_profile_log(run["profile"], PROFILE_LOG_FILE, teacher=teacher_name, mode=run["mode"], event="時間割作成",
+                                       students=len(run["result"]["student_names"]), days=len(run["result"]["dates"]))
+            except Exception as e:
+                st.error(f"エラー: {e}")
\ No newline at end of file
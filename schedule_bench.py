@@ -0,0 +1,249 @@
+import argparse
+import io
+import datetime
+import json
+import math
+import pickle
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+from schedule_core import (
+    SUBJECTS, PERIODS, build_calendar_index, get_week_ranges, is_open, new_shift_store,
+    shift_week_df, shift_store_avail, get_student_names, parse_weekly_data, check_sufficiency, feasibility_bound, get_requirements,
+    solve_greedy, solve_flow, get_unscheduled, export_schedule_excel, encode_save_data, read_save_file
+)
+
+# ==========================================
+# 0. 条件 (シナリオ) の定義
+#   python schedule_bench.py --suite default --out bench.json --compare 前回.json
+# ==========================================
+BASE_SCENARIO = {
+    "students": 50,
+    "start_date": "2025-12-01",
+    "end_date": "2026-01-31",
+    "density": 0.5,          # 生徒の「〇」の割合 (開校コマのうち)
+    "teacher_density": 0.8,  # コーチが出られるコマの割合 (開校コマのうち)
+    "half_ratio": 0.3,       # コーチが出られるコマのうち「△」の割合
+    "overrides": 0,          # 開校時間を個別に変更する日数
+    "max_req": 4,            # 1教科あたりの希望コマ数の上限
+    "seed": 0
+}
+
+# 基本条件から1項目ずつ動かす
+SUITE_AXES = {
+    "quick": {
+        "students": [10, 100],
+    },
+    "default": {
+        "students": [10, 50, 100, 250, 500],
+        "end_date": ["2026-03-31", "2026-11-30"],
+        "density": [0.2, 0.8],
+        "half_ratio": [0.0, 0.7],
+        "overrides": [10, 40],
+    },
+}
+
+# 大規模な組み合わせ (1年間 × 500人) は default にだけ入れる
+SUITE_EXTRA = {
+    "quick": [],
+    "default": [{"students": 500, "end_date": "2026-11-30"}],
+}
+
+def build_scenarios(suite):
+    scenarios = [dict(BASE_SCENARIO, name="base")]
+    for key, values in SUITE_AXES[suite].items():
+        for v in values:
+            if v == BASE_SCENARIO[key]: continue
+            scenarios.append(dict(BASE_SCENARIO, name=f"{key}={v}", **{key: v}))
+    for extra in SUITE_EXTRA[suite]:
+        name = ",".join(f"{k}={v}" for k, v in extra.items())
+        scenarios.append(dict(BASE_SCENARIO, name=name, **extra))
+    return scenarios
+
+# ==========================================
+# 1. 入力データの生成 (保存データ .pkl と同じ形)
+# ==========================================
+def generate_workload(scenario):
+    """シード固定で、コーチ・生徒のシフト表と希望数表を作る"""
+    import pandas as pd
+    rng = random.Random(scenario["seed"])
+    np_rng = np.random.default_rng(scenario["seed"])
+    start = datetime.date.fromisoformat(scenario["start_date"])
+    end = datetime.date.fromisoformat(scenario["end_date"])
+    n_days = (end - start).days + 1
+
+    overrides = {}
+    for offset in rng.sample(range(n_days), min(scenario["overrides"], n_days)):
+        overrides[start + datetime.timedelta(days=offset)] = sorted(rng.sample(PERIODS, rng.randint(0, len(PERIODS))))
+    config = {"start_date": start, "end_date": end, "overrides": overrides}
+    cal_index = build_calendar_index(start, end, overrides)
+    weeks = get_week_ranges(cal_index)
+
+    def make_week(w, marks, probs):
+        cols = [d.strftime("%m/%d(%a)") for d in w["dates"]]
+        open_cells = np.array([[is_open(cal_index, d, p) for d in w["dates"]] for p in PERIODS])
+        values = np_rng.choice(marks, size=open_cells.shape, p=probs).astype(object)
+        values[~open_cells] = "×"
+        return pd.DataFrame(values, columns=cols, index=PERIODS)
+
+    td, half = scenario["teacher_density"], scenario["half_ratio"]
+    teacher_probs = [td * (1 - half), td * half, 1 - td]
+    teacher = {w["label"]: make_week(w, ["〇", "△", "×"], teacher_probs) for w in weeks}
+    names = [f"生徒{i:03d}" for i in range(scenario["students"])]
+    density = scenario["density"]
+    students = {n: {w["label"]: make_week(w, ["〇", "×"], [density, 1 - density]) for w in weeks} for n in names}
+    rows = [dict({"生徒名": n}, **{k: rng.randint(0, scenario["max_req"]) for k in SUBJECTS}) for n in names]
+    return {
+        "calendar_config": config,
+        "teacher_name": "ベンチ",
+        "teacher_weekly_data": teacher,
+        "student_weekly_data": students,
+        "student_req_df": pd.DataFrame(rows)
+    }
+
+# ==========================================
+# 2. 計測
+# ==========================================
+def measure(fn, repeat=1, memory=True):
+    """fn() の最短実行時間と (memory=True なら) tracemalloc のピークを測る"""
+    best = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    stats = {"seconds": round(best, 6)}
+    if memory:
+        tracemalloc.start()
+        fn()
+        stats["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    return out, stats
+
+SOLVERS = {"greedy": solve_greedy, "flow": solve_flow}
+
+def run_scenario(scenario, modes, repeat=1, memory=True):
+    data = generate_workload(scenario)
+    config = data["calendar_config"]
+    req_df = data["student_req_df"]
+    stages = {}
+    cal_index, stages["build_calendar_index"] = measure(
+        lambda: build_calendar_index(config["start_date"], config["end_date"], config["overrides"]), repeat, memory)
+    weeks = get_week_ranges(cal_index)
+    names = get_student_names(req_df)
+    _, stages["new_shift_store"] = measure(lambda: new_shift_store(cal_index, names), repeat, memory)
+    # 週ごとの DataFrame で保存された古い形式の読み込み
+    legacy, stages["parse_weekly_data"] = measure(
+        lambda: parse_weekly_data(data["teacher_weekly_data"], data["student_weekly_data"], names, cal_index), repeat, memory)
+    store = {"start_date": cal_index["start_date"], "student_names": names, "codes": legacy["codes"]}
+    # 全員・全週の編集画面を1回ずつ表示した場合
+    _, stages["shift_week_df"] = measure(
+        lambda: [shift_week_df(store, person, w["dates"], cal_index) for person in range(1 + len(names)) for w in weeks], repeat, memory)
+    avail, stages["shift_store_avail"] = measure(lambda: shift_store_avail(store, cal_index, names), repeat, memory)
+
+    # 保存・復元: 以前の pickle (週ごとの DataFrame) と zip 形式
+    legacy_bytes, stages["save_pickle_legacy"] = measure(lambda: pickle.dumps(data), repeat, memory)
+    _, stages["load_pickle_legacy"] = measure(lambda: pickle.loads(legacy_bytes), repeat, memory)
+    _, stages["migrate_pickle_legacy"] = measure(lambda: read_save_file(io.BytesIO(legacy_bytes)), repeat, memory)
+    saved = {"teacher_name": data["teacher_name"], "student_list": names, "calendar_config": config,
+             "shift_store": store, "student_req_df": req_df}
+    zip_bytes, stages["save_zip"] = measure(lambda: encode_save_data(saved), repeat, memory)
+    _, stages["load_zip"] = measure(lambda: read_save_file(io.BytesIO(zip_bytes)), repeat, memory)
+    file_bytes = {"pickle_legacy": len(legacy_bytes), "zip": len(zip_bytes)}
+    warnings, stages["check_sufficiency"] = measure(lambda: check_sufficiency(avail, req_df), repeat, memory)
+    reqs = get_requirements(req_df, avail["student_names"])
+    requested = sum(reqs)
+    bound, stages["feasibility_bound"] = measure(lambda: feasibility_bound(avail, reqs), repeat, memory)
+
+    solves = {}
+    for mode in modes:
+        result, stage = measure(lambda: SOLVERS[mode](avail, reqs), repeat, memory)
+        stages[f"solve_{mode}"] = stage
+        unscheduled = sum(u["不足"] for u in get_unscheduled(result))
+        solves[mode] = {"placed": requested - unscheduled, "unscheduled": unscheduled, "loop_count": result.get("loop_count")}
+        _, stages[f"export_{mode}"] = measure(lambda: export_schedule_excel(result, cal_index), repeat, memory)
+    return {
+        "name": scenario["name"],
+        "params": {k: v for k, v in scenario.items() if k != "name"},
+        "days": len(cal_index["dates"]),
+        "open_slots": int(cal_index["open_mask"].sum()),
+        "requested": requested,
+        "warnings": len(warnings),
+        "max_total": bound["max_total"],  # 計算前に求めた配置数の上限
+        "file_bytes": file_bytes,
+        "solves": solves,
+        "stages": stages
+    }
+
+def environment_info():
+    import pandas as pd
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds")
+    }
+
+# ==========================================
+# 3. 前回の結果との比較
+# ==========================================
+MIN_COMPARE_SECONDS = 0.01  # これより短い段階は誤差が大きいので比較しない
+
+def compare_results(old, new, threshold=1.5):
+    """遅くなった段階 (threshold 倍以上) と配置数が減ったシナリオを返す"""
+    regressions = []
+    old_by_name = {s["name"]: s for s in old["scenarios"]}
+    for s in new["scenarios"]:
+        prev = old_by_name.get(s["name"])
+        if prev is None: continue
+        for stage, stats in s["stages"].items():
+            before = prev["stages"].get(stage, {}).get("seconds")
+            if not before or stats["seconds"] < MIN_COMPARE_SECONDS: continue
+            ratio = stats["seconds"] / before
+            if ratio >= threshold:
+                regressions.append(f"{s['name']} {stage}: {before:.4f}s → {stats['seconds']:.4f}s (x{ratio:.2f})")
+        for mode, solve in s["solves"].items():
+            before = prev["solves"].get(mode)
+            if before and solve["placed"] < before["placed"]:
+                regressions.append(f"{s['name']} {mode}: 配置数 {before['placed']} → {solve['placed']}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="時間割作成の各段階 (読み込み・チェック・計算・Excel出力) の処理時間を測る")
+    parser.add_argument("--suite", choices=sorted(SUITE_AXES), default="quick", help="シナリオの組")
+    parser.add_argument("--modes", default="greedy", help="計測する計算方式 (カンマ区切り: greedy,flow)")
+    parser.add_argument("--repeat", type=int, default=1, help="各段階の繰り返し回数 (最短時間を記録)")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc によるメモリ計測を行わない")
+    parser.add_argument("--only", help="名前にこの文字列を含むシナリオだけ実行")
+    parser.add_argument("--out", default="bench_result.json", help="結果の JSON ファイル")
+    parser.add_argument("--compare", help="比較する前回の結果 (JSON)")
+    parser.add_argument("--threshold", type=float, default=1.5, help="この倍率以上遅くなったら退行とみなす")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    for m in modes:
+        if m not in SOLVERS: parser.error(f"未対応の計算方式: {m}")
+    scenarios = [s for s in build_scenarios(args.suite) if not args.only or args.only in s["name"]]
+    results = []
+    for scenario in scenarios:
+        r = run_scenario(scenario, modes, args.repeat, not args.no_memory)
+        results.append(r)
+        timings = " ".join(f"{k}={v['seconds']:.3f}s" for k, v in r["stages"].items())
+        placed = " ".join(f"{m}={v['placed']}/{r['requested']}" for m, v in r["solves"].items())
+        print(f"{r['name']}: {placed} | {timings}")
+
+    report = {"suite": args.suite, "modes": modes, "repeat": args.repeat, "environment": environment_info(), "scenarios": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), report, args.threshold)
+        for line in regressions: print(f"退行: {line}")
+        if regressions: return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
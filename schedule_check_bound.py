@@ -0,0 +1,65 @@
+import argparse
+import datetime
+import sys
+import numpy as np
+from schedule_core import SUBJECTS, MAX_SEATS, feasibility_bound, solve_flow, solve_greedy
+
+# ==========================================
+# feasibility_bound (入れられる授業数の上限) の確認
+#   python schedule_check_bound.py --trials 400 --seed 1
+# 小さな条件をランダムに作り、最小費用流の最大配置数・貪欲法の配置数と比べる。
+# 上限は「どの計算方式でもこれより多くは入らない」ので、最大配置数を下回ったら誤り
+# ==========================================
+def random_case(rng):
+    """生徒 2〜14人・1〜7日のランダムな条件 (avail, reqs)"""
+    n_students = int(rng.integers(2, 15))
+    n_days = int(rng.integers(1, 8))
+    dates = [datetime.date(2026, 1, 1) + datetime.timedelta(days=d) for d in range(n_days)]
+    codes = np.zeros((1 + n_students, n_days, 6), dtype=np.uint8)
+    codes[0] = rng.choice([0, 2, 6], size=(n_days, 6))
+    codes[1:] = rng.random((n_students, n_days, 6)) < rng.uniform(0.1, 0.9)
+    reqs = rng.integers(0, rng.integers(1, 6), size=n_students * len(SUBJECTS)).tolist()
+    avail = {"dates": dates, "open_mask": np.ones((n_days, 6), dtype=bool),
+             "student_names": [f"生徒{i:02d}" for i in range(n_students)], "codes": codes}
+    return avail, reqs
+
+def placed_per_student(result):
+    """生徒ごとに入った授業数"""
+    seats = np.asarray(result["slots"], dtype=np.int32).reshape(-1, MAX_SEATS)
+    return np.bincount(seats[seats >= 0] >> 3, minlength=len(result["student_names"]))
+
+def check_case(avail, reqs):
+    """誤りの説明のリスト (なければ空) と、上限が最大配置数より大きかったか"""
+    bound = feasibility_bound(avail, reqs)
+    flow = solve_flow(avail, reqs)
+    greedy = solve_greedy(avail, reqs)
+    errors = []
+    if bound["max_total"] < flow["max_placeable"]:
+        errors.append(f"全体の上限 {bound['max_total']} < 最大配置数 {flow['max_placeable']}")
+    if bound["max_total"] < int(placed_per_student(greedy).sum()):
+        errors.append(f"全体の上限 {bound['max_total']} < 貪欲法の配置数 {int(placed_per_student(greedy).sum())}")
+    for name, result in (("最小費用流", flow), ("貪欲法", greedy)):
+        over = np.flatnonzero(placed_per_student(result) > bound["student_bounds"])
+        if over.size: errors.append(f"{name}: 生徒ごとの上限を超えた生徒 {over.tolist()}")
+    if int(bound["student_bounds"].sum()) < bound["max_total"]:
+        errors.append("全体の上限が生徒ごとの上限の和より大きい")
+    return errors, bound["max_total"] > flow["max_placeable"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="feasibility_bound が最大配置数を下回らないことをランダムな条件で確かめる")
+    parser.add_argument("--trials", type=int, default=400, help="試す条件の数")
+    parser.add_argument("--seed", type=int, default=1, help="乱数のシード")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    failures, loose = 0, 0
+    for trial in range(args.trials):
+        errors, is_loose = check_case(*random_case(rng))
+        loose += is_loose
+        for e in errors: print(f"誤り (条件 {trial}): {e}")
+        failures += bool(errors)
+    print(f"{args.trials}件中 誤り {failures}件、上限が最大配置数より大きかった {loose}件")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
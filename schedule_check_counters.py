@@ -0,0 +1,84 @@
+import argparse
+import datetime
+import sys
+import numpy as np
+import pandas as pd
+from schedule_core import (
+    SUBJECTS, build_calendar_index, get_week_ranges, new_shift_store, shift_store_avail, get_requirements,
+    shift_edits_from_editor, apply_shift_edits, feasibility_bound, requested_totals,
+    new_sufficiency_counters, update_sufficiency_shift, update_sufficiency_requests, sufficiency_summary
+)
+
+# ==========================================
+# 空きコマの集計 (差分更新) の確認
+#   python schedule_check_counters.py --steps 300 --seed 5
+# シフト・希望数をランダムに編集し、そのたびに差分で直した集計が全体を数え直した集計と一致するか、
+# sufficiency_summary が作成時のチェック (feasibility_bound) と矛盾しないかを確かめる
+# ==========================================
+TEACHER_OPTIONS = ["〇", "×", "△"]
+STUDENT_OPTIONS = ["〇", "×"]
+
+def random_edit(rng, store, weeks, cal_index, n_students):
+    """1人の1週間分に、data_editor の edited_rows と同じ形の編集を作って書き込む"""
+    person = 0 if rng.random() < 0.3 else int(rng.integers(1, n_students + 1))
+    options = TEACHER_OPTIONS if person == 0 else STUDENT_OPTIONS
+    week = weeks[int(rng.integers(0, len(weeks)))]
+    edited_rows = {}
+    for _ in range(int(rng.integers(1, 6))):
+        col = week["dates"][int(rng.integers(0, len(week["dates"])))].strftime("%m/%d(%a)")
+        edited_rows.setdefault(int(rng.integers(0, 6)), {})[col] = options[int(rng.integers(0, len(options)))]
+    edits = shift_edits_from_editor(store, person, week["dates"], edited_rows, cal_index)
+    apply_shift_edits(store, edits, cal_index)
+    return edits
+
+def compare_counters(counters, fresh):
+    """食い違っている集計の名前"""
+    return [k for k in fresh if not np.array_equal(np.asarray(fresh[k]), np.asarray(counters[k]))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="空きコマの集計の差分更新が数え直しと一致することをランダムな編集で確かめる")
+    parser.add_argument("--students", type=int, default=40, help="生徒数")
+    parser.add_argument("--steps", type=int, default=300, help="編集の回数")
+    parser.add_argument("--seed", type=int, default=5, help="乱数のシード")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    cal_index = build_calendar_index(datetime.date(2025, 12, 1), datetime.date(2026, 1, 31), {datetime.date(2025, 12, 3): [1, 2]})
+    names = [f"生徒{i:03d}" for i in range(args.students)]
+    store = new_shift_store(cal_index, names)
+    store["codes"][1:] = np.where(rng.random(store["codes"][1:].shape) < 0.4, 7, 0) * cal_index["open_mask"]
+    store["codes"][0] = rng.choice([0, 2, 6], size=store["codes"][0].shape) * cal_index["open_mask"]
+    req_df = pd.DataFrame([dict({"生徒名": n}, **{k: int(rng.integers(0, 3)) for k in SUBJECTS}) for n in names])
+    counters = new_sufficiency_counters(store, cal_index, requested_totals(req_df, names))
+    weeks = get_week_ranges(cal_index)
+
+    failures = 0
+    for step in range(args.steps):
+        if rng.random() < 0.15:
+            # 希望数の変更 (0 ⇔ 1以上 の切り替えが起こるように、半分は生徒の希望をすべて 0 にする)
+            row = int(rng.integers(0, args.students))
+            if rng.random() < 0.5: req_df.loc[row, SUBJECTS] = 0
+            else: req_df.loc[row, str(rng.choice(SUBJECTS))] = int(rng.integers(1, 4))
+            update_sufficiency_requests(counters, store, requested_totals(req_df, names))
+        else:
+            update_sufficiency_shift(counters, store, random_edit(rng, store, weeks, cal_index, args.students), cal_index)
+        fresh = new_sufficiency_counters(store, cal_index, requested_totals(req_df, names))
+        mismatched = compare_counters(counters, fresh)
+        if mismatched:
+            print(f"誤り (編集 {step}): 数え直しと食い違う集計 {mismatched}")
+            failures += 1
+            counters = fresh
+            continue
+        summary = sufficiency_summary(counters, names)
+        bound = feasibility_bound(shift_store_avail(store, cal_index, names), get_requirements(req_df, names))
+        at_risk = {name for name, _, _ in summary["at_risk"]}
+        expected = {name for name, req, b in zip(names, bound["requested"].tolist(), bound["student_bounds"].tolist()) if b < req}
+        if at_risk != expected or summary["max_total"] < bound["max_total"]:
+            print(f"誤り (編集 {step}): 集計の上限 {summary['max_total']} / 作成時の上限 {bound['max_total']}、"
+                  f"不足の生徒 {sorted(at_risk ^ expected)} が一致しない")
+            failures += 1
+    print(f"{args.steps}回の編集中 誤り {failures}回")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
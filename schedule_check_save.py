@@ -0,0 +1,133 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import pickle
+import sys
+import zipfile
+import numpy as np
+import pandas as pd
+from schedule_core import (
+    SUBJECTS, SAVE_VERSION, build_calendar_index, new_shift_store, shift_store_avail, parse_weekly_data,
+    get_student_names, get_requirements, solve_greedy, encode_save_data, read_save_file
+)
+from schedule_bench import BASE_SCENARIO, generate_workload
+
+# ==========================================
+# 保存データ (zip + JSON) の確認
+#   python schedule_check_save.py --seeds 5
+# 1. 以前の .pkl → 読み込み → zip → 読み込み で、可否・希望数・期間設定が変わらないか
+# 2. zip の中身の並び (ファイル名・大きさ・ビットの順) が変わっていないか
+# 3. 壊れたデータ・新しい版・許可していない型を含む .pkl を読み込まないか
+# ==========================================
+SCENARIOS = [
+    {},
+    {"students": 3, "overrides": 10},
+    {"students": 25, "end_date": "2026-03-31", "half_ratio": 0.7},
+]
+
+def masked_codes(store, cal_index, names):
+    """保存するのは生徒の bit0 とコーチの受け入れ人数 (bit1-2) だけなので、比べるのもその部分だけ"""
+    codes = shift_store_avail(store, cal_index, names)["codes"]
+    return np.concatenate([(codes[:1] >> 1) & 3, codes[1:] & 1])
+
+def check_round_trip(scenario):
+    """誤りの説明のリスト"""
+    data = generate_workload(dict(BASE_SCENARIO, **scenario))
+    config = data["calendar_config"]
+    cal_index = build_calendar_index(config["start_date"], config["end_date"], config["overrides"])
+    names = get_student_names(data["student_req_df"])
+    expected = parse_weekly_data(data["teacher_weekly_data"], data["student_weekly_data"], names, cal_index)["codes"]
+    expected = np.concatenate([(expected[:1] >> 1) & 3, expected[1:] & 1])
+
+    legacy = read_save_file(io.BytesIO(pickle.dumps(data)))
+    loaded = read_save_file(io.BytesIO(encode_save_data(legacy)))
+    errors = []
+    for label, saved in (("以前の .pkl", legacy), ("zip", loaded)):
+        if not np.array_equal(masked_codes(saved["shift_store"], cal_index, names), expected):
+            errors.append(f"{label}: 可否が元のシフト表と一致しない")
+    if loaded["calendar_config"] != config: errors.append("zip: 期間設定が一致しない")
+    if loaded["teacher_name"] != data["teacher_name"]: errors.append("zip: コーチ名が一致しない")
+    if get_requirements(loaded["student_req_df"], names) != get_requirements(data["student_req_df"], names):
+        errors.append("zip: 希望数が一致しない")
+    avail = shift_store_avail(loaded["shift_store"], cal_index, names)
+    reqs = get_requirements(data["student_req_df"], names)
+    before = solve_greedy(parse_weekly_data(data["teacher_weekly_data"], data["student_weekly_data"], names, cal_index), reqs)
+    if list(solve_greedy(avail, reqs)["slots"]) != list(before["slots"]): errors.append("zip: 読み込んだデータの時間割が変わる")
+    return errors
+
+def check_layout():
+    """小さなデータを保存し、zip の中身の並びを確かめる"""
+    config = {"start_date": datetime.date(2026, 1, 5), "end_date": datetime.date(2026, 1, 6), "overrides": {}}
+    cal_index = build_calendar_index(config["start_date"], config["end_date"], {})
+    names = ["生徒A", "生徒B"]
+    store = new_shift_store(cal_index, names)
+    store["codes"][:] = 0
+    store["codes"][0, 0, 0] = 6   # コーチ 1日目1講「〇」 (保存するのは 3。計算のときに MAX_SEATS で抑える)
+    store["codes"][0, 1, 5] = 2   # コーチ 2日目6講「△」 (1人)
+    store["codes"][1, 0, 0] = 1   # 生徒A 1日目1講
+    store["codes"][2, 1, 5] = 1   # 生徒B 2日目6講 (生徒の最後のセル)
+    req_df = pd.DataFrame([{"生徒名": "生徒A", **{k: 0 for k in SUBJECTS}, "数学": 3}, {"生徒名": "生徒B", **{k: 0 for k in SUBJECTS}, "英語": 1}])
+    saved = {"teacher_name": "確認", "student_list": names, "calendar_config": config, "shift_store": store, "student_req_df": req_df}
+    errors = []
+    with zipfile.ZipFile(io.BytesIO(encode_save_data(saved))) as zf:
+        if sorted(zf.namelist()) != ["header.json", "requirements.bin", "student_avail.bin", "teacher_cap.bin"]:
+            errors.append(f"zip のファイルが変わった: {sorted(zf.namelist())}")
+            return errors
+        header = json.loads(zf.read("header.json").decode("utf-8"))
+        student_avail = zf.read("student_avail.bin")
+        teacher_cap = zf.read("teacher_cap.bin")
+        requirements = np.frombuffer(zf.read("requirements.bin"), dtype="<i4")
+    if header["version"] != SAVE_VERSION: errors.append(f"版数 {header['version']} != {SAVE_VERSION}")
+    # 生徒の可否は (生徒, 日, 講) の順に1ビットずつ、下位ビットから詰める: 24セル → 3バイト
+    if student_avail != bytes([0x01, 0x00, 0x80]): errors.append(f"student_avail.bin の並びが変わった: {student_avail.hex()}")
+    if teacher_cap != bytes([3] + [0] * 10 + [1]): errors.append(f"teacher_cap.bin の並びが変わった: {teacher_cap.hex()}")
+    if requirements.tolist() != [0, 3, 0, 0, 0, 0, 0, 1, 0, 0]: errors.append(f"requirements.bin の並びが変わった: {requirements.tolist()}")
+    return errors
+
+class _RunsCommand:
+    def __reduce__(self):
+        return (os.system, ("echo 読み込み時にコマンドが実行されました",))
+
+def check_rejects():
+    """読み込んではいけないデータで例外になるか"""
+    errors = []
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("header.json", json.dumps({"format": "juku-schedule", "version": SAVE_VERSION + 1}))
+    # (データ, 期待する例外)。許可していない型は組み立てる前に止まる (UnpicklingError) こと
+    bad_inputs = {
+        "壊れた zip": (b"PK\x03\x04broken", zipfile.BadZipFile),
+        "新しい版の zip": (buf.getvalue(), ValueError),
+        "許可していない型を含む .pkl": (pickle.dumps({"student_req_df": _RunsCommand()}), pickle.UnpicklingError),
+    }
+    for label, (data, expected) in bad_inputs.items():
+        try:
+            read_save_file(io.BytesIO(data))
+            errors.append(f"{label} を読み込んでしまった")
+        except expected:
+            pass
+        except Exception as e:
+            errors.append(f"{label}: {expected.__name__} ではなく {type(e).__name__} になった")
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存データの読み書きで内容が変わらないこと・zip の並びが変わっていないことを確かめる")
+    parser.add_argument("--seeds", type=int, default=3, help="シナリオごとに試すシードの数")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for scenario in SCENARIOS:
+        for seed in range(args.seeds):
+            for e in check_round_trip(dict(scenario, seed=seed)):
+                print(f"誤り ({scenario or '基本'} seed={seed}): {e}")
+                failures += 1
+    for e in check_layout() + check_rejects():
+        print(f"誤り: {e}")
+        failures += 1
+    print(f"保存データの確認: 誤り {failures}件")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
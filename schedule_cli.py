@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from schedule_core import (
+    parse_calendar_config, build_calendar_index, get_student_names, read_save_file, shift_store_avail,
+    check_sufficiency, get_requirements, solve_greedy, solve_flow, improve_schedule, solve_school,
+    get_unscheduled, export_schedule_excel, EXCEL_EXTRA_SHEETS
+)
+
+# ==========================================
+# 保存データ (.zip / 以前の .pkl) をまとめて解くバッチ処理
+#   python schedule_cli.py 保存フォルダ -o 出力フォルダ --mode flow --workers 8
+#   python schedule_cli.py 校舎フォルダ --school  (コーチごとの保存データをまとめて、生徒が重ならないように解く)
+# ==========================================
+SAVED_EXTENSIONS = (".zip", ".pkl")
+
+def load_saved_file(path, fallback_config=None):
+    with open(path, "rb") as f:
+        return read_save_file(f, fallback_config)
+
+def solve_saved_file(path, out_dir, mode="greedy", local_search=0.0, fallback_config=None, extra_sheets=()):
+    """保存ファイル1件を解いて Excel を書き出し、集計用の dict を返す"""
+    t0 = time.perf_counter()
+    stem = os.path.splitext(os.path.basename(path))[0]
+    try:
+        data = load_saved_file(path, fallback_config)
+        config = data["calendar_config"]
+        cal_index = build_calendar_index(config["start_date"], config["end_date"], config.get("overrides", {}))
+        req_df = data["student_req_df"]
+        avail = shift_store_avail(data["shift_store"], cal_index, get_student_names(req_df))
+        warnings = check_sufficiency(avail, req_df)
+        reqs = get_requirements(req_df, avail["student_names"])
+        result = solve_flow(avail, reqs) if mode == "flow" else solve_greedy(avail, reqs)
+        if local_search > 0: result = improve_schedule(avail, result, time_budget=local_search)
+        teacher = data["teacher_name"] or stem
+        out_path = os.path.join(out_dir, f"完成時間割_{teacher}_{stem}.xlsx")
+        with open(out_path, "wb") as f:
+            f.write(export_schedule_excel(result, cal_index, extra_sheets))
+        unscheduled = get_unscheduled(result)
+        requested = sum(r for r in reqs if r > 0)
+        missing = sum(u["不足"] for u in unscheduled)
+        return {
+            "file": path,
+            "teacher": teacher,
+            "output": out_path,
+            "students": len(avail["student_names"]),
+            "requested": requested,
+            "placed": requested - missing,
+            "unscheduled": unscheduled,
+            "warnings": warnings,
+            "seconds": round(time.perf_counter() - t0, 3)
+        }
+    except Exception as e:
+        return {"file": path, "error": f"{type(e).__name__}: {e}", "seconds": round(time.perf_counter() - t0, 3)}
+
+def solve_school_files(paths, out_dir, mode="greedy", fallback_config=None, extra_sheets=(), max_workers=None):
+    """保存ファイルを同じ校舎のコーチ1人ずつとみなし、生徒のダブルブッキングがないようにまとめて解く。
+    期間は --config があればそれ、なければ1件目の保存データの設定にそろえる"""
+    saved = [load_saved_file(p, fallback_config) for p in paths]
+    config = fallback_config or saved[0]["calendar_config"]
+    cal_index = build_calendar_index(config["start_date"], config["end_date"], config.get("overrides", {}))
+    coaches = []
+    for data in saved:
+        req_df = data["student_req_df"]
+        avail = shift_store_avail(data["shift_store"], cal_index, get_student_names(req_df))
+        coaches.append({"avail": avail, "reqs": get_requirements(req_df, avail["student_names"]), "warnings": check_sufficiency(avail, req_df)})
+    school = solve_school(coaches, mode, max_workers)
+    results = []
+    for path, data, coach, result in zip(paths, saved, coaches, school["results"]):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        teacher = data["teacher_name"] or stem
+        out_path = os.path.join(out_dir, f"完成時間割_{teacher}_{stem}.xlsx")
+        with open(out_path, "wb") as f:
+            f.write(export_schedule_excel(result, cal_index, extra_sheets))
+        unscheduled = get_unscheduled(result)
+        requested = sum(r for r in coach["reqs"] if r > 0)
+        results.append({
+            "file": path,
+            "teacher": teacher,
+            "output": out_path,
+            "students": len(coach["avail"]["student_names"]),
+            "requested": requested,
+            "placed": requested - sum(u["不足"] for u in unscheduled),
+            "unscheduled": unscheduled,
+            "warnings": coach["warnings"],
+            "repair": result.get("repair")
+        })
+    return results, {k: school[k] for k in ("conflicts", "removed", "added")}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存データ (.zip / .pkl) のフォルダをまとめて時間割にする")
+    parser.add_argument("input_dir", help="保存データ (.zip / .pkl) のあるフォルダ")
+    parser.add_argument("-o", "--out", help="Excel と summary.json の出力先 (既定: input_dir/output)")
+    parser.add_argument("--mode", choices=["greedy", "flow"], default="greedy", help="計算方式")
+    parser.add_argument("--local-search", type=float, default=0.0, metavar="SEC", help="局所探索に使う秒数 (0 で行わない)")
+    parser.add_argument("--workers", type=int, default=None, help="並列プロセス数 (既定: CPU数)")
+    parser.add_argument("--sheets", nargs="*", choices=sorted(EXCEL_EXTRA_SHEETS), default=[], help="Excel に追加するシート (student: 生徒別, day: 日付別)")
+    parser.add_argument("--school", action="store_true", help="フォルダ内の保存データを同じ校舎のコーチとみなし、生徒が重ならないようにまとめて解く (局所探索は行わない)")
+    parser.add_argument("--config", help="calendar_config を含まない保存データ用の設定ファイル (admin_settings.json)")
+    args = parser.parse_args(argv)
+
+    out_dir = args.out or os.path.join(args.input_dir, "output")
+    os.makedirs(out_dir, exist_ok=True)
+    fallback_config = None
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            fallback_config = parse_calendar_config(json.load(f))
+    paths = sorted(
+        os.path.join(args.input_dir, name) for name in os.listdir(args.input_dir)
+        if name.lower().endswith(SAVED_EXTENSIONS)
+    )
+    if not paths:
+        print(f"保存データが見つかりません: {args.input_dir}", file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    results = []
+    school = None
+    if args.school:
+        try:
+            results, school = solve_school_files(paths, out_dir, args.mode, fallback_config, tuple(args.sheets), args.workers)
+        except Exception as e:
+            print(f"NG {args.input_dir}: {type(e).__name__}: {e}", file=sys.stderr)
+            return 1
+        for r in results: print(f"OK {r['file']}: {r['placed']}/{r['requested']}コマ")
+        print(f"生徒の重なりを解消: {school['conflicts']}件 (外した授業 {school['removed']}コマ, 入れ直した授業 {school['added']}コマ)")
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(solve_saved_file, p, out_dir, args.mode, args.local_search, fallback_config, tuple(args.sheets)) for p in paths]
+            for future in as_completed(futures):
+                r = future.result()
+                results.append(r)
+                if "error" in r: print(f"NG {r['file']}: {r['error']}", file=sys.stderr)
+                else: print(f"OK {r['file']}: {r['placed']}/{r['requested']}コマ ({r['seconds']}s)")
+    results.sort(key=lambda r: r["file"])
+    summary = {
+        "mode": args.mode,
+        "files": len(results),
+        "failed": sum(1 for r in results if "error" in r),
+        "placed": sum(r.get("placed", 0) for r in results),
+        "requested": sum(r.get("requested", 0) for r in results),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "results": results
+    }
+    if school is not None: summary["school"] = school
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
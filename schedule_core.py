@@ -0,0 +1,1673 @@
+import os
+import io
+import re
+import csv
+import math
+import time
+import random
+import heapq
+import json
+import pickle
+import zipfile
+import datetime
+import hashlib
+import threading
+import contextlib
+import tracemalloc
+from collections import OrderedDict
+from array import array
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import get_context, shared_memory
+import numpy as np
+
+# ==========================================
+# 0. 定数
+# ==========================================
+SUBJECTS = ["国語", "数学", "英語", "理科", "社会"]
+PERIODS = [1, 2, 3, 4, 5, 6]
+MAX_SEATS = 2  # 1コマに入れる生徒の最大数 (コーチ「〇」のとき)
+DEFAULT_WEIGHTS = (100, 10)  # 貪欲法のコマ優先度 (前後のコマが埋まっている加点, 同じ日の授業1コマあたりの加点)
+LOCAL_SEARCH_WEIGHTS = (1000, 10, 100)  # 局所探索の評価値 (授業1コマ, 連続したコマ1組, コーチの出勤日1日あたりの減点)
+# 出勤日の減点は1日で作れる連続 (最大5組) の加点より十分大きくし、連続を増やすために出勤日を増やさないようにする
+PROGRESS_EVERY = 32  # on_progress を呼ぶ間隔 (授業の配置数。局所探索では 256 回 × この数の試行ごと)
+
+# ==========================================
+# 1. カレンダー
+# ==========================================
+def parse_calendar_config(data):
+    """設定ファイル (JSON) の中身を calendar_config に変換する"""
+    config = {}
+    config["start_date"] = datetime.datetime.strptime(data["start_date"], "%Y-%m-%d").date()
+    config["end_date"] = datetime.datetime.strptime(data["end_date"], "%Y-%m-%d").date()
+    overrides = {}
+    for k, v in data.get("overrides", {}).items():
+        d_key = datetime.datetime.strptime(k, "%Y-%m-%d").date()
+        overrides[d_key] = v
+    config["overrides"] = overrides
+    return config
+
+def dump_calendar_config(config):
+    """calendar_config を JSON に書ける形 (日付は文字列) にする。parse_calendar_config の逆"""
+    return {
+        "start_date": config["start_date"].strftime("%Y-%m-%d"),
+        "end_date": config["end_date"].strftime("%Y-%m-%d"),
+        "overrides": {k.strftime("%Y-%m-%d"): v for k, v in config.get("overrides", {}).items()}
+    }
+
+def get_base_open_periods(date_obj):
+    m, d, w = date_obj.month, date_obj.day, date_obj.weekday()
+    if m == 1 and d in [1, 2, 3]: return []
+    if m == 12 and d == 31: return []
+    if w in [5, 6]: return [2, 3, 4, 5, 6]
+    return [4, 5, 6]
+
+def get_open_periods(date_obj, overrides):
+    if date_obj in overrides:
+        return overrides[date_obj]
+    return get_base_open_periods(date_obj)
+
+HEADER_DATE_RE = re.compile(r"(\d+)/(\d+)")
+
+def build_calendar_index(start_date, end_date, overrides, version=0):
+    """期間内の日付一覧、列見出しの (月, 日) → 日付 の対応表、(日数, 6) の開講コママスクを作る"""
+    dates = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    month_day = {}
+    for d in dates: month_day.setdefault((d.month, d.day), d)
+    open_mask = np.zeros((len(dates), 6), dtype=bool)
+    for i, d in enumerate(dates):
+        periods = overrides[d] if d in overrides else get_base_open_periods(d)
+        for p in periods:
+            if 1 <= p <= 6: open_mask[i, p - 1] = True
+    return {
+        "version": version,
+        "start_date": start_date,
+        "end_date": end_date,
+        "overrides": overrides,
+        "open_mask": open_mask,
+        "dates": dates,
+        "date_index": {d: i for i, d in enumerate(dates)},
+        "month_day": month_day,
+        "headers": {}  # 列見出し → 日付 (解決済みのものを覚えておく)
+    }
+
+def is_open(cal_index, d_date, p):
+    """開講コマかどうか (期間内ならマスクを1回引くだけ)"""
+    i = cal_index["date_index"].get(d_date)
+    if i is None: return p in get_open_periods(d_date, cal_index["overrides"])
+    return bool(cal_index["open_mask"][i, p - 1])
+
+def resolve_header_date(header, cal_index):
+    """列見出し ("12/01(Mon)" など) を日付に変換。期間外の月日は開始年として扱う"""
+    headers = cal_index["headers"]
+    if header in headers: return headers[header]
+    d_date = None
+    match = HEADER_DATE_RE.search(str(header))
+    if match:
+        m, d = int(match.group(1)), int(match.group(2))
+        d_date = cal_index["month_day"].get((m, d))
+        if d_date is None:
+            try: d_date = datetime.date(cal_index["start_date"].year, m, d)
+            except ValueError: pass
+    headers[header] = d_date
+    return d_date
+
+def get_week_ranges(cal_index):
+    dates = cal_index["dates"]
+    weeks = []
+    for i in range(0, len(dates), 7):
+        current_dates = dates[i : i+7]
+        label = f"{current_dates[0].strftime('%m/%d')} 〜 {current_dates[-1].strftime('%m/%d')}"
+        weeks.append({"label": label, "dates": current_dates})
+    return weeks
+
+# ==========================================
+# 2. シフト表の読み込み
+# ==========================================
+STUDENT_OK_MARKS = ["〇", "○", "OK", "△", "▲", "1", "2", "3", "全"]
+TEACHER_FULL_MARKS = ["〇", "○", "OK", "全"]
+TEACHER_HALF_MARKS = ["△", "▲", "半", "1"]
+
+def mark_code(val):
+    """セルの値を uint8 コードに変換 (bit0: 生徒が出席可, bit1-2: コーチの受け入れ人数 0/1/2)"""
+    val = str(val)
+    code = 1 if any(x in val for x in STUDENT_OK_MARKS) else 0
+    if any(x in val for x in TEACHER_FULL_MARKS): code |= 2 << 1
+    elif any(x in val for x in TEACHER_HALF_MARKS): code |= 1 << 1
+    return code
+
+# よく使う記号はあらかじめ変換表にしておく (それ以外の値だけ mark_code で判定)
+MARK_CODES = {v: mark_code(v) for v in ["〇", "○", "OK", "△", "▲", "半", "全", "×", "", "nan", "None"]}
+
+def get_student_names(req_df):
+    """希望数表の生徒名 (重複なし・登録順)"""
+    return list(dict.fromkeys(req_df['生徒名']))
+
+def parse_weekly_data(teacher_weekly_data, student_weekly_data, student_names, cal_index):
+    """週ごとの DataFrame 群を (1 + 生徒数, 日数, 6) の uint8 配列にまとめる
+    [0] がコーチ、[1 + i] が student_names[i]。期間外の日付の列は読み飛ばす"""
+    import pandas as pd
+    dates = cal_index["dates"]
+    date_index = cal_index["date_index"]
+    def header_to_day(date_str):
+        d_date = resolve_header_date(date_str, cal_index)
+        return date_index.get(d_date, -1) if d_date else -1
+
+    period_index = pd.Index(PERIODS)
+    people = [teacher_weekly_data or {}] + [student_weekly_data.get(name) or {} for name in student_names]
+    blocks, person_idx, day_idx = [], [], []
+    for i, weekly_data in enumerate(people):
+        for df in weekly_data.values():
+            days = [header_to_day(c) for c in df.columns]
+            if not any(x >= 0 for x in days): continue
+            if not df.index.equals(period_index): df = df.reindex(index=period_index)
+            blocks.append(df.to_numpy(dtype=object))
+            person_idx.extend([i] * len(days))
+            day_idx.extend(days)
+
+    codes = np.zeros((len(people), len(dates), len(PERIODS)), dtype=np.uint8)
+    if blocks:
+        values = np.concatenate(blocks, axis=1)
+        # 値の種類ごとに1回だけ判定し、変換表を引く (-1 は欠損値 → 0)
+        labels, uniques = pd.factorize(values.ravel())
+        table = np.array([MARK_CODES[u] if u in MARK_CODES else mark_code(u) for u in uniques] + [0], dtype=np.uint8)
+        cell_codes = table[labels].reshape(values.shape)
+        person_idx = np.asarray(person_idx)
+        day_idx = np.asarray(day_idx)
+        keep = day_idx >= 0
+        codes[person_idx[keep], day_idx[keep], :] = cell_codes[:, keep].T
+    return {"dates": dates, "open_mask": cal_index["open_mask"], "student_names": list(student_names), "codes": codes}
+
+# シフトの保持 (セッション・保存データ用)
+# コーチと生徒の可否を (1 + 生徒数, 日数, 6) の uint8 コード (mark_code と同じ) で持ち、
+# 画面に出す週の分だけ DataFrame にする
+TEACHER_MARKS = np.array(["×", "△", "〇", "〇"], dtype=object)  # コーチの受け入れ人数 → 記号
+STUDENT_MARKS = np.array(["×", "〇"], dtype=object)
+
+def new_shift_store(cal_index, student_names):
+    """空のシフト (開校コマは「〇」、それ以外は「×」)"""
+    codes = np.zeros((1 + len(student_names), len(cal_index["dates"]), len(PERIODS)), dtype=np.uint8)
+    codes[:, cal_index["open_mask"]] = MARK_CODES["〇"]
+    return {"start_date": cal_index["start_date"], "student_names": list(student_names), "codes": codes}
+
+def align_shift_store(store, cal_index):
+    """期間が変わったときに日付をそろえる (重なる日はそのまま残し、新しい日は空のシフト)。変化がなければ store をそのまま返す"""
+    n_days = len(cal_index["dates"])
+    if store["start_date"] == cal_index["start_date"] and store["codes"].shape[1] == n_days: return store
+    aligned = new_shift_store(cal_index, store["student_names"])
+    offset = (store["start_date"] - cal_index["start_date"]).days
+    src_lo, dst_lo = max(0, -offset), max(0, offset)
+    length = min(store["codes"].shape[1] - src_lo, n_days - dst_lo)
+    if length > 0: aligned["codes"][:, dst_lo:dst_lo + length] = store["codes"][:, src_lo:src_lo + length]
+    return aligned
+
+def shift_person_index(store, name):
+    """0 がコーチ、生徒は 1 + 登録順。見つからなければ None"""
+    if name is None: return 0
+    try: return 1 + store["student_names"].index(name)
+    except ValueError: return None
+
+def shift_week_df(store, person, dates, cal_index):
+    """1週間分を data_editor に渡す DataFrame にする (person は shift_person_index の番号)"""
+    import pandas as pd
+    days = [cal_index["date_index"][d] for d in dates]
+    block = store["codes"][person, days, :].T
+    marks = TEACHER_MARKS[(block >> 1) & 3] if person == 0 else STUDENT_MARKS[block & 1]
+    return pd.DataFrame(marks, columns=[d.strftime("%m/%d(%a)") for d in dates], index=PERIODS)
+
+def shift_cell_mark(store, person, day, period):
+    """store の1セルを画面の記号にする"""
+    code = store["codes"][person, day, period - 1]
+    return TEACHER_MARKS[(code >> 1) & 3] if person == 0 else STUDENT_MARKS[code & 1]
+
+def shift_edits_from_editor(store, person, dates, edited_rows, cal_index):
+    """data_editor の編集差分 (edited_rows: {行番号: {列名: 値}}) を変更セルの一覧にする
+    各要素は {"person", "name", "date", "period", "old", "new"}。値が変わっていないセルは含めない"""
+    col_dates = {d.strftime("%m/%d(%a)"): d for d in dates}
+    edits = []
+    for row, changes in edited_rows.items():
+        period = PERIODS[int(row)]
+        for col, new in changes.items():
+            d = col_dates.get(col)
+            if d is None or new is None: continue
+            old = shift_cell_mark(store, person, cal_index["date_index"][d], period)
+            if new == old: continue
+            name = None if person == 0 else store["student_names"][person - 1]
+            edits.append({"person": person, "name": name, "date": d, "period": period, "old": old, "new": new})
+    return edits
+
+def apply_shift_edits(store, edits, cal_index):
+    """変更セルだけを store に書き込む"""
+    for e in edits:
+        store["codes"][e["person"], cal_index["date_index"][e["date"]], e["period"] - 1] = \
+            MARK_CODES[e["new"]] if e["new"] in MARK_CODES else mark_code(e["new"])
+
+def shift_store_avail(store, cal_index, student_names):
+    """計算用の可否データ (parse_weekly_data と同じ形)。student_names にない生徒は全コマ不可"""
+    store = align_shift_store(store, cal_index)
+    codes = np.zeros((1 + len(student_names), len(cal_index["dates"]), len(PERIODS)), dtype=np.uint8)
+    codes[0] = store["codes"][0]
+    for i, name in enumerate(student_names):
+        person = shift_person_index(store, name)
+        if person is not None: codes[1 + i] = store["codes"][person]
+    return {"dates": cal_index["dates"], "open_mask": cal_index["open_mask"], "student_names": list(student_names), "codes": codes}
+
+def shift_store_from_saved(saved, cal_index):
+    """保存データからシフトを取り出す。週ごとの DataFrame で保存された古い形式も読み込む"""
+    if saved.get("shift_store") is not None: return align_shift_store(saved["shift_store"], cal_index)
+    names = saved.get("student_list") or get_student_names(saved["student_req_df"])
+    avail = parse_weekly_data(saved.get("teacher_weekly_data"), saved.get("student_weekly_data") or {}, names, cal_index)
+    return {"start_date": cal_index["start_date"], "student_names": list(names), "codes": avail["codes"]}
+
+def feasibility_bound(avail, reqs, max_rounds=20):
+    """計算する前に、入れられる授業数の上限を求める (どの計算方式でもこれより多くは入らない)
+    生徒ごとの上限: 生徒が行けてコーチも受け入れられるコマを、1日3コマまでで数えた数 (希望数が上限)。
+    全体の上限: 最小費用流と同じネットワークのカット (Hall の条件) の容量。生徒の集合 A を選び、
+      A の生徒は生徒ごとの上限、残りの生徒は日ごとに min(各コマの min(受け入れ人数, 行ける生徒数) の和, 生徒ごとの1日の上限の和)
+    で抑える。A は「外したほうが上限が下がる生徒」を足していく近似で選ぶ (最大流は求めないので速い)"""
+    codes = avail["codes"]
+    n_students = len(avail["student_names"])
+    n_days = len(avail["dates"])
+    teacher_cap = np.minimum(((codes[0] >> 1) & 3) * avail["open_mask"], MAX_SEATS).astype(np.int32)
+    req = np.maximum(np.frombuffer(array('i', reqs), dtype=np.int32).reshape(n_students, len(SUBJECTS)), 0).sum(axis=1)
+    ok = (codes[1:] & 1).astype(bool) & (teacher_cap > 0) & (req > 0)[:, None, None]
+    day_caps = np.minimum(ok.sum(axis=2), 3)
+    student_bounds = np.minimum(req, day_caps.sum(axis=1))
+
+    ok_flat = ok.reshape(n_students, n_days * 6).astype(np.int32)
+    cap_flat = teacher_cap.ravel()
+    rest = req > 0  # A に入れていない生徒
+    best = int(student_bounds.sum())
+    for _ in range(max_rounds):
+        n_avail = rest.astype(np.int32) @ ok_flat
+        slot_terms = np.minimum(cap_flat, n_avail).reshape(n_days, 6).sum(axis=1)
+        student_terms = rest.astype(np.int32) @ day_caps
+        best = min(best, int(student_bounds[~rest].sum() + np.minimum(slot_terms, student_terms).sum()))
+        # 生徒を外したときに下がる量: コマ側で抑えている日は取り合いになっているコマの数、生徒側で抑えている日は1日の上限
+        tight = (n_avail <= cap_flat).astype(np.int32)
+        gain = np.where(slot_terms <= student_terms, (ok_flat * tight).reshape(n_students, n_days, 6).sum(axis=2), day_caps).sum(axis=1)
+        move = rest & (student_bounds < gain)
+        if not move.any(): break
+        rest &= ~move
+    return {
+        "requested": req,
+        "student_bounds": student_bounds,
+        "max_total": best,
+        "shortfall": int(req.sum()) - best
+    }
+
+def check_sufficiency(avail, req_df):
+    """feasibility_bound から、計算しても必ず入りきらない授業の警告を作る"""
+    bound = feasibility_bound(avail, get_requirements(req_df, avail["student_names"]))
+    warnings = []
+    for name, req_num, max_num in zip(avail["student_names"], bound["requested"].tolist(), bound["student_bounds"].tolist()):
+        if max_num < req_num:
+            warnings.append(f"{name}：希望 {req_num}コマ > 入れられる上限 {max_num}コマ (不足確定: {req_num - max_num})")
+    competition = int(bound["student_bounds"].sum()) - bound["max_total"]
+    if competition > 0:
+        warnings.append(f"全体：希望 {int(bound['requested'].sum())}コマ > 入れられる上限 {bound['max_total']}コマ "
+                        f"(不足確定: {bound['shortfall']}、うち {competition}コマはコーチの空きコマの取り合いによる)")
+    return warnings
+
+def requested_totals(req_df, student_names):
+    """生徒ごとの希望コマ数合計 (student_names の順、表にない生徒は 0)"""
+    totals = req_df.set_index("生徒名")[SUBJECTS].fillna(0).astype(int).clip(lower=0).sum(axis=1)
+    totals = totals[~totals.index.duplicated(keep="last")]
+    return totals.reindex(list(student_names), fill_value=0).to_numpy(dtype=np.int32)
+
+def new_sufficiency_counters(store, cal_index, requested):
+    """編集のたびに差分で直す空きコマの集計を作る (読み込み・リセット・期間変更のときだけ全体を数える)
+    teacher_cap: コマごとの受け入れ人数、student_day: 生徒が行けてコーチも受け入れられるコマの日ごとの数、
+    slot_demand: コマごとの「希望がある生徒のうち行ける人数」、capped_total: 生徒ごとに1日3コマまでで数えた合計、
+    day_student_caps: 日ごとの「希望がある生徒の 1日の上限 の和」"""
+    codes = store["codes"]
+    teacher_cap = np.minimum(((codes[0] >> 1) & 3) * cal_index["open_mask"], MAX_SEATS).astype(np.int32)
+    requested = np.asarray(requested, dtype=np.int32)
+    ok = (codes[1:] & 1).astype(bool) & (teacher_cap > 0)
+    student_day = ok.sum(axis=2).astype(np.int32)
+    capped = np.minimum(student_day, 3)
+    return {
+        "teacher_cap": teacher_cap,
+        "student_day": student_day,
+        "slot_demand": ok[requested > 0].sum(axis=0).astype(np.int32),
+        "capped_total": capped.sum(axis=1).astype(np.int32),
+        "day_student_caps": capped[requested > 0].sum(axis=0).astype(np.int32),
+        "requested": requested
+    }
+
+def _shift_student_days(counters, students, di, delta):
+    before = np.minimum(counters["student_day"][students, di], 3)
+    counters["student_day"][students, di] += delta
+    change = np.minimum(counters["student_day"][students, di], 3) - before
+    counters["capped_total"][students] += change
+    counters["day_student_caps"][di] += int(change[counters["requested"][students] > 0].sum())
+
+def update_sufficiency_shift(counters, store, edits, cal_index):
+    """変更セル (shift_edits_from_editor の形) の分だけ集計を直す。apply_shift_edits で書き込んだあとに呼ぶ
+    生徒のセルは1セルずつ、コーチのセルはそのコマの生徒の列だけを見る"""
+    date_index = cal_index["date_index"]
+    teacher_cap = counters["teacher_cap"]
+    for e in edits:
+        di = date_index.get(e["date"])
+        if di is None: continue
+        pi = e["period"] - 1
+        code = int(store["codes"][e["person"], di, pi])
+        if e["person"] == 0:
+            new_cap = min(((code >> 1) & 3) * int(cal_index["open_mask"][di, pi]), MAX_SEATS)
+            if (new_cap > 0) != (teacher_cap[di, pi] > 0):
+                free = np.flatnonzero(store["codes"][1:, di, pi] & 1)
+                _shift_student_days(counters, free, di, 1 if new_cap > 0 else -1)
+                counters["slot_demand"][di, pi] = int((counters["requested"][free] > 0).sum()) if new_cap > 0 else 0
+            teacher_cap[di, pi] = new_cap
+        elif teacher_cap[di, pi] > 0:
+            s = e["person"] - 1
+            delta = (code & 1) - (mark_code(e["old"]) & 1)
+            if delta == 0: continue
+            _shift_student_days(counters, np.array([s]), di, delta)
+            if counters["requested"][s] > 0: counters["slot_demand"][di, pi] += delta
+
+def update_sufficiency_requests(counters, store, requested):
+    """希望数が変わったときに集計を直す。シフトを見直すのは希望が 0 ⇔ 1以上 に変わった生徒だけ"""
+    requested = np.asarray(requested, dtype=np.int32)
+    for s in np.flatnonzero((requested > 0) != (counters["requested"] > 0)).tolist():
+        sign = 1 if requested[s] > 0 else -1
+        ok = (store["codes"][1 + s] & 1).astype(bool) & (counters["teacher_cap"] > 0)
+        counters["slot_demand"] += sign * ok.astype(np.int32)
+        counters["day_student_caps"] += sign * np.minimum(counters["student_day"][s], 3)
+    counters["requested"] = requested
+
+def sufficiency_summary(counters, student_names):
+    """集計から、受け入れ枠・入れられる上限・不足確定の生徒を求める
+    上限は feasibility_bound の「A を空にした場合」と「全員を A にした場合」の小さいほう (作成時のチェックより粗いことがある)"""
+    requested = counters["requested"]
+    bounds = np.minimum(requested, counters["capped_total"])
+    slot_terms = np.minimum(counters["teacher_cap"], counters["slot_demand"]).sum(axis=1)
+    max_total = min(int(bounds.sum()), int(np.minimum(slot_terms, counters["day_student_caps"]).sum()))
+    at_risk = [(student_names[s], int(requested[s]), int(bounds[s])) for s in np.flatnonzero(bounds < requested).tolist()]
+    return {"requested": int(requested.sum()), "seats": int(counters["teacher_cap"].sum()), "max_total": max_total, "at_risk": at_risk}
+
+# ==========================================
+# 3. コマ割り計算 (貪欲法・最小費用流)
+# ==========================================
+def get_requirements(req_df, student_names):
+    """希望数表 → [生徒番号 * 5 + 教科番号] の必要コマ数配列"""
+    by_name = {}
+    for _, row in req_df.iterrows():
+        by_name[row['生徒名']] = [int(row.get(k, 0)) for k in SUBJECTS]
+    reqs = array('i')
+    for name in student_names: reqs.extend(by_name.get(name, [0] * len(SUBJECTS)))
+    return reqs
+
+def solve_greedy(avail, reqs, seed=42, max_loops=3000, weights=DEFAULT_WEIGHTS, on_progress=None):
+    """生徒・日付・教科をすべて番号で扱ってコマ割りを作る (名前は表示・出力時に付ける)
+    コマ番号は 日付番号 * 6 + (講 - 1)。slots[コマ番号 * MAX_SEATS + 席] に
+    (生徒番号 << 3 | 教科番号) を入れ、空席は -1。weights は (前後のコマが埋まっている加点, 同じ日の授業1コマあたりの加点)
+    on_progress(配置した授業数) が True を返したら、そこまでの時間割で打ち切る"""
+    dates = avail["dates"]
+    codes = avail["codes"]
+    student_names = avail["student_names"]
+    n_days, n_students, n_subjects = len(dates), len(student_names), len(SUBJECTS)
+    n_slots = n_days * 6
+    teacher_cap = np.minimum(((codes[0] >> 1) & 3) * avail["open_mask"], MAX_SEATS).astype(np.uint8)
+    slot_caps = bytearray(teacher_cap.tobytes())
+    open_slots = np.flatnonzero(teacher_cap).tolist()
+
+    reqs = array('i', reqs)
+    remaining = array('i', [sum(reqs[i * n_subjects:(i + 1) * n_subjects]) for i in range(n_students)])
+    # コマごとに「行ける生徒」のビット集合を持つ (bit i = 生徒番号 i、逆引きインデックス)
+    packed = np.packbits(codes[1:] & 1, axis=0, bitorder="little").reshape(-1, n_slots)
+    slot_avail = [0] * n_slots
+    for sid in open_slots: slot_avail[sid] = int.from_bytes(packed[:, sid].tobytes(), "little")
+
+    slots = array('i', [-1]) * (n_slots * MAX_SEATS)
+    slot_fill = bytearray(n_slots)
+    slot_members = [0] * n_slots
+    date_counts = array('i', [0]) * n_days
+    daily_counts = bytearray(n_students * n_days)
+    daily_full_mask = [0] * n_days  # 日付番号 → その日すでに3コマ入っている生徒のビット集合
+    remaining_buckets = {}  # 残りコマ数 → 該当する生徒のビット集合
+    for i in range(n_students):
+        if remaining[i] > 0:
+            remaining_buckets[remaining[i]] = remaining_buckets.get(remaining[i], 0) | (1 << i)
+    remaining_mask = 0
+    for mask in remaining_buckets.values(): remaining_mask |= mask
+    rng = random.Random(seed)
+    neighbour_weight, date_weight = weights
+
+    # スロット優先度キュー (遅延無効化ヒープ)
+    # 1コマ配置するごとに、スコアが変わりうる同じ日付のコマ (p±1 を含む) だけを再計算する
+    heap = []
+    slot_version = array('i', [0]) * n_slots
+    closed_slots = bytearray(n_slots)  # 候補者がいなくなったコマ (以降も候補は増えないので除外)
+    slots_scored = 0
+    def push_slot(sid):
+        nonlocal slots_scored
+        slot_version[sid] += 1
+        if closed_slots[sid] or slot_fill[sid] >= slot_caps[sid]: return
+        slots_scored += 1
+        pi = sid % 6
+        score = 0
+        if pi > 0 and slot_fill[sid - 1]: score += neighbour_weight
+        if pi < 5 and slot_fill[sid + 1]: score += neighbour_weight
+        score += date_counts[sid // 6] * date_weight
+        score += rng.random()
+        heapq.heappush(heap, (-score, sid, slot_version[sid]))
+    for sid in open_slots: push_slot(sid)
+
+    loop_count = 0
+    candidates_examined = 0
+    while heap and loop_count < max_loops:
+        _, sid, version = heapq.heappop(heap)
+        if slot_version[sid] != version: continue
+        di = sid // 6
+        candidates = slot_avail[sid] & remaining_mask & ~daily_full_mask[di] & ~slot_members[sid]
+        if not candidates:
+            closed_slots[sid] = 1
+            continue
+        loop_count += 1
+        candidates_examined += candidates.bit_count()
+        # 残りコマ数が最大の生徒から、同数ならランダムに1人選ぶ
+        r = max(r for r, mask in remaining_buckets.items() if mask & candidates)
+        top = candidates & remaining_buckets[r]
+        for _ in range(rng.randrange(top.bit_count())): top &= top - 1
+        bit = top & -top
+        s = bit.bit_length() - 1
+        # 残りが最も多い教科 (同数なら教科名の降順)
+        base = s * n_subjects
+        k = max(range(n_subjects), key=lambda k: (reqs[base + k], SUBJECTS[k]))
+        reqs[base + k] -= 1
+        remaining[s] -= 1
+        remaining_buckets[r] &= ~bit
+        if r > 1: remaining_buckets[r - 1] = remaining_buckets.get(r - 1, 0) | bit
+        else: remaining_mask &= ~bit
+        daily_counts[s * n_days + di] += 1
+        if daily_counts[s * n_days + di] >= 3: daily_full_mask[di] |= bit
+        date_counts[di] += 1
+        slot_members[sid] |= bit
+        slots[sid * MAX_SEATS + slot_fill[sid]] = (s << 3) | k
+        slot_fill[sid] += 1
+        for q in range(di * 6, di * 6 + 6): push_slot(q)
+        if on_progress is not None and loop_count % PROGRESS_EVERY == 0 and on_progress(loop_count): break
+    return {
+        "dates": dates,
+        "student_names": student_names,
+        "slot_caps": slot_caps,
+        "slots": slots,
+        "reqs_left": reqs,
+        "loop_count": loop_count,
+        "max_loops": max_loops,
+        "slots_scored": slots_scored,
+        "candidates_examined": candidates_examined
+    }
+
+def get_unscheduled(result):
+    """入りきらなかった授業の一覧"""
+    unscheduled = []
+    reqs_left = result["reqs_left"]
+    for i, s in enumerate(result["student_names"]):
+        for k, subj in enumerate(SUBJECTS):
+            cnt = reqs_left[i * len(SUBJECTS) + k]
+            if cnt > 0: unscheduled.append({"生徒名": s, "科目": subj, "不足": cnt})
+    return unscheduled
+
+def min_cost_max_flow(n_nodes, edges, source, sink, on_progress=None):
+    """最小費用最大流 (主双対法)。edges は (始点, 終点, 容量, 費用) のリストで費用は0以上の整数
+    ダイクストラでポテンシャルを更新し、被約費用0の辺だけを使って Dinic でまとめて流す
+    on_progress(流量) が True を返したら、そこまでの流れで打ち切る (費用は最小とは限らない)
+    戻り値は (流量, 総費用, 辺ごとの流量)"""
+    to, cap, cost = [], [], []
+    adj = [[] for _ in range(n_nodes)]
+    for u, v, c, w in edges:
+        adj[u].append(len(to)); to.append(v); cap.append(c); cost.append(w)
+        adj[v].append(len(to)); to.append(u); cap.append(0); cost.append(-w)
+    INF = float("inf")
+    h = [0] * n_nodes
+    flow = total_cost = 0
+    stopped = False
+    while not stopped:
+        dist = [INF] * n_nodes
+        dist[source] = 0
+        pq = [(0, source)]
+        while pq:
+            d, u = heapq.heappop(pq)
+            if d > dist[u]: continue
+            hu = h[u]
+            for e in adj[u]:
+                if cap[e] > 0:
+                    v = to[e]
+                    nd = d + cost[e] + hu - h[v]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        heapq.heappush(pq, (nd, v))
+        if dist[sink] == INF: break
+        for v in range(n_nodes):
+            if dist[v] < INF: h[v] += dist[v]
+        # 被約費用0の辺だけのグラフで阻止流を流す (流せなくなるまで)
+        while not stopped:
+            level = [-1] * n_nodes
+            level[source] = 0
+            queue = [source]
+            for u in queue:
+                hu = h[u]
+                for e in adj[u]:
+                    v = to[e]
+                    if cap[e] > 0 and level[v] < 0 and cost[e] + hu - h[v] == 0:
+                        level[v] = level[u] + 1
+                        queue.append(v)
+            if level[sink] < 0: break
+            it = [0] * n_nodes
+            while True:
+                path = []
+                u = source
+                while u != sink:
+                    edges_u = adj[u]
+                    while it[u] < len(edges_u):
+                        e = edges_u[it[u]]
+                        v = to[e]
+                        if cap[e] > 0 and level[v] == level[u] + 1 and cost[e] + h[u] - h[v] == 0: break
+                        it[u] += 1
+                    if it[u] < len(edges_u):
+                        path.append(e)
+                        u = v
+                    elif u == source:
+                        break
+                    else:
+                        level[u] = -1  # 行き止まり
+                        e = path.pop()
+                        u = to[e ^ 1]
+                        it[u] += 1
+                if u != sink: break
+                f = min(cap[e] for e in path)
+                for e in path:
+                    cap[e] -= f
+                    cap[e ^ 1] += f
+                flow += f
+                total_cost += f * (h[sink] - h[source])
+                if on_progress is not None and flow % PROGRESS_EVERY == 0 and on_progress(flow):
+                    stopped = True
+                    break
+    return flow, total_cost, [cap[2 * i + 1] for i in range(len(edges))]
+
+def solve_flow(avail, reqs, on_progress=None):
+    """最小費用流でコマ割りを作る (配置できる授業数が最大になることが保証される)
+    ネットワーク: 始点 → 生徒 (希望合計) → 生徒×日 (1日3コマまで) → コマ (生徒1人1席) → 終点 (コーチの受け入れ人数)
+    費用は「前後のコマもコーチが空いている」「コーチの出勤日が多く入る」「生徒の空きが多い日」ほど安くし、
+    連続したコマ・まとまった日程になりやすくする。戻り値は solve_greedy と同じ形式
+    on_progress は min_cost_max_flow に渡す (打ち切ったときは配置数も最大とは限らない)"""
+    dates = avail["dates"]
+    codes = avail["codes"]
+    student_names = avail["student_names"]
+    n_days, n_students, n_subjects = len(dates), len(student_names), len(SUBJECTS)
+    n_slots = n_days * 6
+    teacher_cap = np.minimum(((codes[0] >> 1) & 3) * avail["open_mask"], MAX_SEATS).astype(np.uint8)
+    reqs = array('i', reqs)
+    totals = [sum(max(r, 0) for r in reqs[i * n_subjects:(i + 1) * n_subjects]) for i in range(n_students)]
+
+    # コマの費用: 前後のコマが開いていない (0〜2) + コーチの空きが少ない日 (0〜1)
+    has_slot = teacher_cap > 0
+    neighbours = np.zeros(teacher_cap.shape, dtype=np.int64)
+    neighbours[:, 1:] += has_slot[:, :-1]
+    neighbours[:, :-1] += has_slot[:, 1:]
+    slot_cost = (2 - neighbours) + (has_slot.sum(axis=1) <= 2)[:, None]
+
+    SOURCE, SINK = 0, 1
+    n_nodes = 2 + n_students
+    edges = []
+    slot_node = {}
+    for sid in np.flatnonzero(teacher_cap).tolist():
+        slot_node[sid] = n_nodes
+        edges.append((n_nodes, SINK, int(teacher_cap.flat[sid]), int(slot_cost.flat[sid])))
+        n_nodes += 1
+    for i in range(n_students):
+        if totals[i] > 0: edges.append((SOURCE, 2 + i, totals[i], 0))
+    # 生徒 × コマの辺 (生徒が行けて、コーチも受け入れられるコマだけ)
+    student_ok = (codes[1:] & 1).astype(bool) & has_slot
+    placement_edges = []  # (辺番号, 生徒番号, コマ番号)
+    for i in range(n_students):
+        if totals[i] <= 0: continue
+        for di in np.flatnonzero(student_ok[i].any(axis=1)).tolist():
+            periods = np.flatnonzero(student_ok[i, di]).tolist()
+            day_cost = 3 - min(len(periods), 3)  # 空きの多い日ほど安い
+            if len(periods) > 3:
+                # 1日3コマの上限が効くときだけ 生徒×日 の中継点を作る
+                day_node = n_nodes
+                n_nodes += 1
+                edges.append((2 + i, day_node, 3, day_cost))
+                start, cost0 = day_node, 0
+            else:
+                start, cost0 = 2 + i, day_cost
+            for pi in periods:
+                sid = di * 6 + pi
+                placement_edges.append((len(edges), i, sid))
+                edges.append((start, slot_node[sid], 1, cost0))
+
+    max_placeable, _, edge_flow = min_cost_max_flow(n_nodes, edges, SOURCE, SINK, on_progress)
+
+    # 流れた辺から配置を復元し、教科は時系列順に「残りが最も多い教科」から割り当てる
+    slots = array('i', [-1]) * (n_slots * MAX_SEATS)
+    slot_fill = bytearray(n_slots)
+    for e, i, sid in placement_edges:
+        if not edge_flow[e]: continue
+        base = i * n_subjects
+        k = max(range(n_subjects), key=lambda k: (reqs[base + k], SUBJECTS[k]))
+        reqs[base + k] -= 1
+        slots[sid * MAX_SEATS + slot_fill[sid]] = (i << 3) | k
+        slot_fill[sid] += 1
+    return {
+        "dates": dates,
+        "student_names": student_names,
+        "slot_caps": bytearray(teacher_cap.tobytes()),
+        "slots": slots,
+        "reqs_left": reqs,
+        "max_placeable": max_placeable
+    }
+
+def repair_schedule(avail, prev_result, reqs, prev_codes=None, changed_cells=None, weights=DEFAULT_WEIGHTS, daily_used=None):
+    """前回の時間割を土台に、成り立たなくなった授業だけを外して入れ直す (関係のない生徒の授業は動かさない)
+    外すのは「生徒が行けなくなった・コーチの受け入れ人数を超えた・希望数を超えた」授業。
+    入れ直すのは、外された生徒・可否が変わった生徒・前回より入っていない授業が増えた (希望数を増やした) 生徒と、
+    コーチの受け入れ人数が増えたコマに行ける、入りきらない授業のある生徒の授業だけ。
+    changed_cells は (人の番号, 日付番号, 講 - 1) の並び (0 がコーチ、1 + i が生徒 i)。
+    省略したときは prev_codes と avail["codes"] の差分から求める。
+    daily_used は (生徒数, 日数) の配列で、生徒がその日ほかのコーチの授業をすでに何コマ受けるか (1日3コマの上限に含める)"""
+    codes = avail["codes"]
+    names = avail["student_names"]
+    if list(prev_result["student_names"]) != list(names) or list(prev_result["dates"]) != list(avail["dates"]):
+        raise ValueError("前回の計算から生徒または期間が変わっているため、差分修正できません")
+    n_days, n_students, n_subjects = len(avail["dates"]), len(names), len(SUBJECTS)
+    n_slots = n_days * 6
+    if changed_cells is None:
+        changed_cells = np.argwhere(prev_codes != codes) if prev_codes is not None else []
+    changed_students = {int(person) - 1 for person, _, _ in changed_cells if person > 0}
+
+    teacher_cap = np.minimum(((codes[0] >> 1) & 3) * avail["open_mask"], MAX_SEATS).astype(np.uint8).ravel()
+    student_ok = (codes[1:] & 1).reshape(n_students, n_slots).astype(bool)
+    seats = np.array(prev_result["slots"], dtype=np.int32).reshape(n_slots, MAX_SEATS)
+
+    # 1. 行けなくなった生徒・受け入れ人数を超えた席を外す (残った席は前に詰める)
+    filled = seats >= 0
+    sid_idx = np.arange(n_slots)[:, None]
+    ok = filled & student_ok[np.where(filled, seats >> 3, 0), sid_idx]
+    keep = ok & (np.cumsum(ok, axis=1) <= teacher_cap[:, None])
+    dropped = filled & ~keep
+    removed = int(dropped.sum())
+    removed_students = set((seats[dropped] >> 3).tolist())
+    order = np.argsort(~keep, axis=1, kind="stable")
+    seats = np.take_along_axis(np.where(keep, seats, -1), order, axis=1)
+    if daily_used is not None:
+        # ほかのコーチの授業と合わせて1日3コマを超える日は、後ろのコマから外す
+        occ_sid, occ_seat = np.nonzero(seats >= 0)
+        own_daily = np.zeros((n_students, n_days), dtype=np.int32)
+        np.add.at(own_daily, (seats[occ_sid, occ_seat] >> 3, occ_sid // 6), 1)
+        for s, di in np.argwhere(own_daily + daily_used > 3):
+            n_drop = int(own_daily[s, di] + daily_used[s, di] - 3)
+            for sid in range(di * 6 + 5, di * 6 - 1, -1):
+                if n_drop == 0: break
+                hit = np.flatnonzero((seats[sid] >= 0) & (seats[sid] >> 3 == s))
+                if hit.size:
+                    seats[sid, hit[0]:] = np.append(seats[sid, hit[0] + 1:], -1)
+                    n_drop -= 1
+                    removed += 1
+            removed_students.add(int(s))
+
+    # 2. 希望数が減った教科は、後ろの日付の授業から外す
+    placed = np.zeros((n_students, n_subjects), dtype=np.int32)
+    kept = seats[seats >= 0]
+    np.add.at(placed, (kept >> 3, kept & 7), 1)
+    reqs_arr = np.frombuffer(array('i', reqs), dtype=np.int32).reshape(n_students, n_subjects)
+    excess = placed - reqs_arr
+    if (excess > 0).any():
+        for sid in range(n_slots - 1, -1, -1):
+            for seat in range(MAX_SEATS - 1, -1, -1):
+                v = seats[sid, seat]
+                if v >= 0 and excess[v >> 3, v & 7] > 0:
+                    excess[v >> 3, v & 7] -= 1
+                    placed[v >> 3, v & 7] -= 1
+                    removed_students.add(int(v >> 3))
+                    removed += 1
+                    seats[sid, seat:] = np.append(seats[sid, seat + 1:], -1)
+
+    # 3. 関係する生徒の授業だけを、前後のコマ・同じ日の授業がある所を優先して入れ直す
+    reqs_left = array('i', np.maximum(reqs_arr - placed, 0).ravel().tolist())
+    slot_fill = (seats >= 0).sum(axis=1).astype(np.int32)
+    occupied = np.zeros((n_students, n_slots), dtype=bool)
+    occ_sid, occ_seat = np.nonzero(seats >= 0)
+    occupied[seats[occ_sid, occ_seat] >> 3, occ_sid] = True
+    daily_counts = occupied.reshape(n_students, n_days, 6).sum(axis=2)
+    if daily_used is not None: daily_counts = daily_counts + daily_used
+    date_counts = slot_fill.reshape(n_days, 6).sum(axis=1)
+    period_idx = np.tile(np.arange(6), n_days)
+    neighbour_weight, date_weight = weights
+    prev_left = np.array(prev_result["reqs_left"], dtype=np.int32).reshape(n_students, n_subjects)
+    left_arr = np.array(reqs_left, dtype=np.int32).reshape(n_students, n_subjects)
+    raised_students = set(np.flatnonzero((left_arr > prev_left).any(axis=1)).tolist())
+    # コーチのシフト変更で空いた席には、入りきらない授業のある生徒のうち、そのコマに行ける生徒を入れる
+    gained = teacher_cap > np.frombuffer(bytes(prev_result["slot_caps"]), dtype=np.uint8)
+    waiting = left_arr.sum(axis=1) > 0
+    opened_students = set(np.flatnonzero(waiting & (student_ok[:, gained] & ~occupied[:, gained]).any(axis=1)).tolist())
+    affected = sorted(changed_students | removed_students | raised_students | opened_students,
+                      key=lambda s: -sum(reqs_left[s * n_subjects:(s + 1) * n_subjects]))
+    added = 0
+    for s in affected:
+        base = s * n_subjects
+        while sum(reqs_left[base:base + n_subjects]) > 0:
+            candidates = student_ok[s] & (slot_fill < teacher_cap) & ~occupied[s] & np.repeat(daily_counts[s] < 3, 6)
+            if not candidates.any(): break
+            filled = slot_fill > 0
+            neighbours = np.zeros(n_slots, dtype=np.int32)
+            neighbours[1:] += filled[:-1] & (period_idx[1:] > 0)
+            neighbours[:-1] += filled[1:] & (period_idx[:-1] < 5)
+            score = neighbours * neighbour_weight + np.repeat(date_counts, 6) * date_weight
+            sid = int(np.argmax(np.where(candidates, score, -1)))
+            k = max(range(n_subjects), key=lambda k: (reqs_left[base + k], SUBJECTS[k]))
+            seats[sid, slot_fill[sid]] = (s << 3) | k
+            slot_fill[sid] += 1
+            occupied[s, sid] = True
+            daily_counts[s, sid // 6] += 1
+            date_counts[sid // 6] += 1
+            reqs_left[base + k] -= 1
+            added += 1
+    return {
+        "dates": avail["dates"],
+        "student_names": names,
+        "slot_caps": bytearray(teacher_cap.tobytes()),
+        "slots": array('i', seats.ravel().tolist()),
+        "reqs_left": reqs_left,
+        "loop_count": added,
+        "repair": {"removed": removed, "added": added, "students": len(affected)}
+    }
+
+# ==========================================
+# 4. 複数シードの並列実行
+# ==========================================
+def schedule_score(result):
+    """良い時間割ほど小さくなる比較用の値: (入りきらなかった授業数, -連続コマ数, コーチの出勤日数)"""
+    slots = result["slots"]
+    n_slots = len(slots) // MAX_SEATS
+    filled = [slots[sid * MAX_SEATS] >= 0 for sid in range(n_slots)]
+    adjacent = sum(1 for sid in range(n_slots - 1) if sid % 6 != 5 and filled[sid] and filled[sid + 1])
+    used_days = sum(1 for di in range(n_slots // 6) if any(filled[di * 6:di * 6 + 6]))
+    unscheduled = sum(r for r in result["reqs_left"] if r > 0)
+    return (unscheduled, -adjacent, used_days)
+
+PROGRESS_INTERVAL = 0.25  # 並列実行中に on_progress を呼ぶ間隔 (秒)
+
+def start_weights(seed, base_seed=42):
+    """試行ごとの優先度の重み。基準のシードは既定値のまま、それ以外は ±50% の範囲でずらす"""
+    if seed == base_seed: return DEFAULT_WEIGHTS
+    rng = random.Random(seed)
+    return tuple(w * rng.uniform(0.5, 1.5) for w in DEFAULT_WEIGHTS)
+
+_worker_avail = None
+_worker_reqs = None
+
+def _init_worker(shm_name, shape, dates, open_mask, student_names, reqs):
+    """ワーカー起動時に1回だけ呼ばれ、共有メモリ上の可否配列をそのまま参照する"""
+    global _worker_avail, _worker_reqs
+    shm = shared_memory.SharedMemory(name=shm_name)
+    codes = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    _worker_avail = {"dates": dates, "open_mask": open_mask, "student_names": student_names, "codes": codes, "shm": shm}
+    _worker_reqs = reqs
+
+WORKER_RESULT_KEYS = ("slots", "reqs_left", "loop_count", "max_loops", "slots_scored", "candidates_examined")
+
+def _solve_start(seed, max_loops):
+    result = solve_greedy(_worker_avail, _worker_reqs, seed, max_loops, start_weights(seed))
+    return seed, {k: result[k] for k in WORKER_RESULT_KEYS}
+
+def solve_multi_start(avail, reqs, n_starts=16, max_workers=None, time_budget=10.0, base_seed=42, max_loops=3000, on_progress=None):
+    """シードと優先度の重みを変えた貪欲法をプロセスプールで並列に実行し、最も良い時間割を返す
+    可否配列は共有メモリで1回だけ渡す。制限時間を過ぎたら、それまでに終わった中で最良のものを返す
+    on_progress(最良の配置数, 最良の schedule_score) を PROGRESS_INTERVAL 秒ごとに呼び、True が返ったら
+    (1件でも終わっていれば) その時点の最良のものを返す"""
+    deadline = time.monotonic() + time_budget
+    seeds = [base_seed + i for i in range(max(1, n_starts))]
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(seeds)))
+    codes = np.ascontiguousarray(avail["codes"], dtype=np.uint8)
+    slot_caps = np.minimum(((codes[0] >> 1) & 3) * avail["open_mask"], MAX_SEATS).astype(np.uint8).tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(codes.nbytes, 1))
+    requested = sum(r for r in reqs if r > 0)
+    best, best_score, finished = None, None, 0
+    executor = None
+    try:
+        np.ndarray(codes.shape, dtype=np.uint8, buffer=shm.buf)[...] = codes
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=get_context("spawn"), initializer=_init_worker,
+            initargs=(shm.name, codes.shape, avail["dates"], avail["open_mask"], avail["student_names"], array('i', reqs))
+        )
+        pending = {executor.submit(_solve_start, seed, max_loops) for seed in seeds}
+        while pending:
+            # 1件も終わっていないうちは制限時間を過ぎても待つ
+            timeout = max(0.0, deadline - time.monotonic()) if best is not None else None
+            if on_progress is not None: timeout = PROGRESS_INTERVAL if timeout is None else min(timeout, PROGRESS_INTERVAL)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                seed, part = future.result()
+                result = {
+                    "dates": avail["dates"],
+                    "student_names": avail["student_names"],
+                    "slot_caps": bytearray(slot_caps),
+                    "seed": seed,
+                    **part
+                }
+                score = schedule_score(result)
+                finished += 1
+                if best is None or score < best_score: best, best_score = result, score
+            if best is None: continue
+            if on_progress is not None and on_progress(requested - best_score[0], best_score): break
+            if not done and time.monotonic() >= deadline: break
+    finally:
+        if executor is not None: executor.shutdown(wait=False, cancel_futures=True)
+        shm.close()
+        shm.unlink()
+    best["starts_finished"] = finished
+    best["starts_requested"] = len(seeds)
+    return best
+
+# ==========================================
+# 5. 局所探索による改善
+# ==========================================
+def improve_schedule(avail, result, time_budget=3.0, seed=42, weights=LOCAL_SEARCH_WEIGHTS, on_progress=None):
+    """できあがった時間割を焼きなまし法で改善する。時間切れになった時点の最良の時間割を返す
+    近傍: 入りきらなかった授業を入れる / 授業を別のコマへ動かす / 2つの授業のコマを入れ替える /
+    授業を入りきらなかった生徒の授業と入れ替える
+    評価値の変化は、変わるコマの前後とその日の授業数だけを見て O(1) で求める
+    on_progress(いまの配置数, 最良の評価値の改善量) が True を返したら、その時点の最良の時間割を返す"""
+    deadline = time.monotonic() + time_budget
+    w_place, w_adj, w_day = weights
+    rng = random.Random(seed)
+    n_days = len(result["dates"])
+    n_slots = n_days * 6
+    n_students, n_subjects = len(result["student_names"]), len(SUBJECTS)
+    slot_caps = result["slot_caps"]
+    slots = array('i', result["slots"])
+    reqs_left = array('i', result["reqs_left"])
+    remaining = array('i', [sum(max(r, 0) for r in reqs_left[i * n_subjects:(i + 1) * n_subjects]) for i in range(n_students)])
+
+    # 生徒が行けて、コーチも受け入れられるコマ
+    ok = ((avail["codes"][1:] & 1).astype(bool) & (np.frombuffer(bytes(slot_caps), dtype=np.uint8) > 0).reshape(n_days, 6)).reshape(n_students, n_slots)
+    ok_flat = bytearray(ok.astype(np.uint8).tobytes())
+    student_slots = [np.flatnonzero(ok[i]).tolist() for i in range(n_students)]
+    open_slots = [sid for sid in range(n_slots) if slot_caps[sid]]
+    if not open_slots: return result
+
+    slot_fill = bytearray(n_slots)
+    daily_counts = bytearray(n_students * n_days)
+    date_counts = array('i', [0]) * n_days
+    for sid in open_slots:
+        for seat in range(MAX_SEATS):
+            v = slots[sid * MAX_SEATS + seat]
+            if v < 0: continue
+            slot_fill[sid] += 1
+            daily_counts[(v >> 3) * n_days + sid // 6] += 1
+            date_counts[sid // 6] += 1
+    pool = [i for i in range(n_students) if remaining[i] > 0]  # 入りきらなかった授業がある生徒 (遅延削除)
+    in_pool = bytearray(n_students)
+    for i in pool: in_pool[i] = 1
+
+    def occupied_neighbours(sid):
+        pi = sid % 6
+        return (pi > 0 and slot_fill[sid - 1] > 0) + (pi < 5 and slot_fill[sid + 1] > 0)
+
+    def add(sid, v):
+        """授業 v をコマに入れ、評価値の変化を返す"""
+        i, di = v >> 3, sid // 6
+        delta = w_place
+        if slot_fill[sid] == 0: delta += w_adj * occupied_neighbours(sid)
+        if date_counts[di] == 0: delta -= w_day
+        slots[sid * MAX_SEATS + slot_fill[sid]] = v
+        slot_fill[sid] += 1
+        daily_counts[i * n_days + di] += 1
+        date_counts[di] += 1
+        reqs_left[i * n_subjects + (v & 7)] -= 1
+        remaining[i] -= 1
+        return delta
+
+    def remove(sid, seat):
+        """コマの席から授業を外し、(評価値の変化, 外した授業) を返す"""
+        base = sid * MAX_SEATS
+        last = slot_fill[sid] - 1
+        v = slots[base + seat]
+        slots[base + seat] = slots[base + last]
+        slots[base + last] = -1
+        slot_fill[sid] -= 1
+        i, di = v >> 3, sid // 6
+        delta = -w_place
+        if slot_fill[sid] == 0: delta -= w_adj * occupied_neighbours(sid)
+        date_counts[di] -= 1
+        if date_counts[di] == 0: delta += w_day
+        daily_counts[i * n_days + di] -= 1
+        reqs_left[i * n_subjects + (v & 7)] += 1
+        remaining[i] += 1
+        if not in_pool[i]:
+            in_pool[i] = 1
+            pool.append(i)
+        return delta, v
+
+    def seated(i, sid):
+        base = sid * MAX_SEATS
+        return any(slots[base + seat] >> 3 == i for seat in range(slot_fill[sid]))
+
+    def pick_pool_student():
+        while pool:
+            j = rng.randrange(len(pool))
+            i = pool[j]
+            if remaining[i] > 0: return i
+            pool[j] = pool[-1]
+            pool.pop()
+            in_pool[i] = 0
+        return -1
+
+    def next_lesson(i):
+        base = i * n_subjects
+        k = max(range(n_subjects), key=lambda k: (reqs_left[base + k], SUBJECTS[k]))
+        return (i << 3) | k
+
+    def can_place(i, sid, day_from=-1):
+        """生徒 i を sid に入れられるか (day_from の日から動かす授業は日ごとの上限に数えない)"""
+        if not ok_flat[i * n_slots + sid] or slot_fill[sid] >= slot_caps[sid] or seated(i, sid): return False
+        di = sid // 6
+        return di == day_from or daily_counts[i * n_days + di] < 3
+
+    current = 0
+    best = 0
+    best_slots, best_reqs = array('i', slots), array('i', reqs_left)
+    t_start, t_end = 2.0 * w_adj, 0.05 * w_adj
+    iterations = 0
+    temperature = t_start
+    while True:
+        iterations += 1
+        if iterations % 256 == 0:
+            now = time.monotonic()
+            if now >= deadline: break
+            if on_progress is not None and iterations % (256 * PROGRESS_EVERY) == 0 and on_progress(sum(slot_fill), best): break
+            progress = 1.0 - (deadline - now) / time_budget if time_budget > 0 else 1.0
+            temperature = t_start * (t_end / t_start) ** progress
+        move = rng.random()
+        sid = open_slots[rng.randrange(len(open_slots))]
+        if move < 0.3:
+            # 入りきらなかった授業を入れる
+            i = pick_pool_student()
+            if i < 0 or not student_slots[i]: continue
+            sid = student_slots[i][rng.randrange(len(student_slots[i]))]
+            if not can_place(i, sid): continue
+            delta = add(sid, next_lesson(i))
+        elif slot_fill[sid] == 0:
+            continue
+        elif move < 0.6:
+            # 授業を別のコマへ動かす
+            seat = rng.randrange(slot_fill[sid])
+            i = slots[sid * MAX_SEATS + seat] >> 3
+            target = student_slots[i][rng.randrange(len(student_slots[i]))]
+            if target == sid or not can_place(i, target, sid // 6): continue
+            delta, v = remove(sid, seat)
+            delta += add(target, v)
+            if delta < 0 and rng.random() >= math.exp(delta / temperature):
+                remove(target, slot_fill[target] - 1)
+                add(sid, v)
+                continue
+        elif move < 0.8:
+            # 2つの授業のコマを入れ替える (埋まり方は変わらないので評価値は不変)
+            other = open_slots[rng.randrange(len(open_slots))]
+            if other == sid or slot_fill[other] == 0: continue
+            a = sid * MAX_SEATS + rng.randrange(slot_fill[sid])
+            b = other * MAX_SEATS + rng.randrange(slot_fill[other])
+            va, vb = slots[a], slots[b]
+            ia, ib = va >> 3, vb >> 3
+            da, db = sid // 6, other // 6
+            if ia == ib or not ok_flat[ia * n_slots + other] or not ok_flat[ib * n_slots + sid]: continue
+            if seated(ia, other) or seated(ib, sid): continue
+            if da != db and (daily_counts[ia * n_days + db] >= 3 or daily_counts[ib * n_days + da] >= 3): continue
+            slots[a], slots[b] = vb, va
+            if da != db:
+                daily_counts[ia * n_days + da] -= 1; daily_counts[ia * n_days + db] += 1
+                daily_counts[ib * n_days + db] -= 1; daily_counts[ib * n_days + da] += 1
+            continue
+        else:
+            # 授業を入りきらなかった生徒の授業と入れ替える (評価値は不変)
+            i = pick_pool_student()
+            seat = rng.randrange(slot_fill[sid])
+            if i < 0 or slots[sid * MAX_SEATS + seat] >> 3 == i: continue
+            if not ok_flat[i * n_slots + sid] or seated(i, sid) or daily_counts[i * n_days + sid // 6] >= 3: continue
+            delta, _ = remove(sid, seat)
+            delta += add(sid, next_lesson(i))
+        current += delta
+        if current > best:
+            best = current
+            best_slots, best_reqs = array('i', slots), array('i', reqs_left)
+
+    improved = dict(result)
+    improved["slots"] = best_slots
+    improved["reqs_left"] = best_reqs
+    improved["local_search"] = {"iterations": iterations, "gain": best}
+    return improved
+
+# ==========================================
+# 6. 表示用データ・Excel 出力
+# ==========================================
+def build_schedule_view(result, cal_index):
+    """計算結果を1回走査して、プレビュー・生徒別表示・Excel が共通で使う表示用データを作る
+    grid: (日数, 6) の各コマの「名前(教科)」のタプル (授業なしは空タプル)
+    by_student: 生徒番号 → [(日付番号, 講, 教科番号), ...] (日付・講の順)
+    by_date: 日付番号 → [(講, 生徒番号, 教科番号), ...]"""
+    names = result["student_names"]
+    slots = result["slots"]
+    n_days = len(cal_index["dates"])
+    grid = np.empty((n_days, len(PERIODS)), dtype=object)
+    by_student = [[] for _ in names]
+    by_date = [[] for _ in range(n_days)]
+    for sid in range(n_days * 6):
+        di, p = divmod(sid, 6)
+        entries = []
+        for v in slots[sid * MAX_SEATS:(sid + 1) * MAX_SEATS]:
+            if v < 0: continue
+            s, k = v >> 3, v & 7
+            entries.append(f"{names[s]}({SUBJECTS[k]})")
+            by_student[s].append((di, p + 1, k))
+            by_date[di].append((p + 1, s, k))
+        grid[di, p] = tuple(entries)
+    return {
+        "dates": cal_index["dates"],
+        "day_labels": [d.strftime("%m/%d(%a)") for d in cal_index["dates"]],
+        "open_mask": cal_index["open_mask"],
+        "student_names": names,
+        "grid": grid,
+        "by_student": by_student,
+        "by_date": by_date,
+        "unscheduled": get_unscheduled(result)
+    }
+
+def schedule_grid_text(view, sep, empty="-", closed="×"):
+    """grid を表示用の文字列の (日数, 6) 配列にする (授業のないコマは開校なら empty、休みなら closed)"""
+    text = np.where(view["open_mask"], empty, closed).astype(object)
+    for (di, p), entries in np.ndenumerate(view["grid"]):
+        if entries: text[di, p] = sep.join(entries)
+    return text
+
+def student_timetable(view, s):
+    """生徒1人の時間割: 授業のある日付ごとに 1〜6講 の教科名を並べた行のリスト"""
+    rows = {}
+    for di, p, k in view["by_student"][s]:
+        rows.setdefault(di, [""] * len(PERIODS))[p - 1] = SUBJECTS[k]
+    return [(view["day_labels"][di], cells) for di, cells in rows.items()]
+
+EXCEL_EXTRA_SHEETS = {"student": "生徒別", "day": "日付別"}  # export_schedule_excel の extra_sheets に指定できるシート
+
+def export_schedule_excel(result, cal_index, extra_sheets=(), view=None):
+    """時間割 (と未消化リスト、extra_sheets に指定した生徒別・日付別の一覧) の Excel ファイルを bytes で返す
+    constant_memory モードで行の順に書き出すので、期間や生徒数が増えてもメモリ使用量はほぼ一定"""
+    import xlsxwriter
+    if view is None: view = build_schedule_view(result, cal_index)
+    names = view["student_names"]
+    day_labels = view["day_labels"]
+    cell_texts = schedule_grid_text(view, "\n", empty="")
+
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    wrap_fmt = workbook.add_format({'text_wrap': True, 'valign': 'top', 'border': 1, 'align': 'center'})
+    header_fmt = workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'border': 1, 'align': 'center'})
+    head_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+    worksheet = workbook.add_worksheet("時間割")
+    worksheet.set_column(0, 0, 5); worksheet.set_column(1, 7, 18)
+    current_row = 0
+    for i in range(0, len(day_labels), 7):
+        week_days = range(i, min(i + 7, len(day_labels)))
+        worksheet.write_string(current_row, 0, "講", header_fmt)
+        for col_idx, di in enumerate(week_days):
+            worksheet.write_string(current_row, col_idx + 1, day_labels[di], header_fmt)
+        for p in PERIODS:
+            row_idx = current_row + p
+            worksheet.write_number(row_idx, 0, p, wrap_fmt)
+            for col_idx, di in enumerate(week_days):
+                worksheet.write_string(row_idx, col_idx + 1, cell_texts[di, p - 1], wrap_fmt)
+        current_row += 8
+
+    if view["unscheduled"]:
+        sheet = workbook.add_worksheet("未消化リスト")
+        cols = ["生徒名", "科目", "不足"]
+        sheet.write_row(0, 0, cols, head_fmt)
+        for row_idx, row in enumerate(view["unscheduled"], start=1):
+            sheet.write_row(row_idx, 0, [row[c] for c in cols])
+
+    if "student" in extra_sheets:
+        sheet = workbook.add_worksheet(EXCEL_EXTRA_SHEETS["student"])
+        sheet.set_column(0, 1, 14)
+        sheet.write_row(0, 0, ["生徒名", "日付", "講", "科目"], head_fmt)
+        row_idx = 1
+        for s, lessons in enumerate(view["by_student"]):
+            for di, p, k in lessons:
+                sheet.write_row(row_idx, 0, [names[s], day_labels[di], p, SUBJECTS[k]])
+                row_idx += 1
+
+    if "day" in extra_sheets:
+        sheet = workbook.add_worksheet(EXCEL_EXTRA_SHEETS["day"])
+        sheet.set_column(0, 0, 12); sheet.set_column(2, 2, 14)
+        sheet.write_row(0, 0, ["日付", "講", "生徒名", "科目"], head_fmt)
+        row_idx = 1
+        for di, lessons in enumerate(view["by_date"]):
+            for p, s, k in lessons:
+                sheet.write_row(row_idx, 0, [day_labels[di], p, names[s], SUBJECTS[k]])
+                row_idx += 1
+
+    workbook.close()
+    return output.getvalue()
+
+# ==========================================
+# 7. 処理時間の計測
+# ==========================================
+SOLVER_COUNTER_KEYS = ("loop_count", "max_loops", "slots_scored", "candidates_examined", "max_placeable", "starts_finished")
+
+def new_profile(memory=False):
+    """計測結果の入れ物。memory=True なら段階ごとに tracemalloc でピークも測る (その分遅くなる)"""
+    return {"memory": memory, "phases": [], "counters": {}}
+
+_NO_PHASE = contextlib.nullcontext()
+
+def phase(profile, name):
+    """with phase(profile, "読み込み"): ... の形で段階の処理時間を測る。profile が None なら何もしない"""
+    if profile is None: return _NO_PHASE
+    return _measure_phase(profile, name)
+
+@contextlib.contextmanager
+def _measure_phase(profile, name):
+    stats = {"段階": name}
+    started_tracing = profile["memory"] and not tracemalloc.is_tracing()
+    if started_tracing: tracemalloc.start()
+    elif profile["memory"]: tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats["秒"] = round(time.perf_counter() - t0, 4)
+        if profile["memory"]:
+            stats["ピークKiB"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            if started_tracing: tracemalloc.stop()
+        profile["phases"].append(stats)
+
+def record_solver_counters(profile, result):
+    """計算結果に含まれる反復回数などを profile["counters"] に写す"""
+    if profile is None: return
+    for k in SOLVER_COUNTER_KEYS:
+        if k in result: profile["counters"][k] = result[k]
+    if "local_search" in result: profile["counters"]["local_search_iterations"] = result["local_search"]["iterations"]
+
+def append_profile_log(profile, path, **info):
+    """計測結果を JSON Lines で1行追記する (info は日時・計算方式など一緒に残したい値)"""
+    entry = dict(info, timestamp=datetime.datetime.now().isoformat(timespec="seconds"),
+                 phases=profile["phases"], counters=profile["counters"])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+# ==========================================
+# 8. 計算結果のキャッシュ
+# ==========================================
+RESULT_CACHE_SIZE = 32  # 保持する計算結果の件数 (古いものから捨てる)
+EXCEL_CACHE_SIZE = 8    # 保持する Excel ファイル (bytes) の件数
+_result_cache = OrderedDict()
+_excel_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def schedule_fingerprint(avail, reqs, **options):
+    """読み込み後の可否配列・開校コマ・希望数と計算条件 (options) から作るキャッシュのキー
+    DataFrame ではなく変換済みの配列をハッシュするので、シフト表の書式の違いには左右されない"""
+    h = hashlib.blake2b(digest_size=16)
+    dates = avail["dates"]
+    codes = np.ascontiguousarray(avail["codes"], dtype=np.uint8)
+    h.update(f"{dates[0] if dates else ''}|{codes.shape}".encode())
+    h.update(codes.tobytes())
+    h.update(np.ascontiguousarray(avail["open_mask"], dtype=bool).tobytes())
+    h.update("\x00".join(avail["student_names"]).encode())
+    h.update(array('i', reqs).tobytes())
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def _cache_get(cache, key):
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None: cache.move_to_end(key)
+        return value
+
+def _cache_put(cache, key, value, max_size):
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size: cache.popitem(last=False)
+
+def get_cached_result(key):
+    """キャッシュ済みの計算結果 (なければ None)。見つかったものは最近使った扱いにする"""
+    return _cache_get(_result_cache, key)
+
+def put_cached_result(key, result, max_size=RESULT_CACHE_SIZE):
+    _cache_put(_result_cache, key, result, max_size)
+
+def cached_schedule_excel(key, result, cal_index, extra_sheets=(), view=None):
+    """export_schedule_excel の結果を (計算結果のキー, 追加シート) ごとに使い回す。key が None なら毎回作る"""
+    if key is None: return export_schedule_excel(result, cal_index, extra_sheets, view)
+    excel_key = (key, tuple(sorted(extra_sheets)))
+    data = _cache_get(_excel_cache, excel_key)
+    if data is None:
+        data = export_schedule_excel(result, cal_index, extra_sheets, view)
+        _cache_put(_excel_cache, excel_key, data, EXCEL_CACHE_SIZE)
+    return data
+
+# ==========================================
+# 9. 保存データ (zip + JSON)
+# ==========================================
+# header.json            : 版数・コーチ名・生徒リスト・期間設定・配列の形
+# student_avail.bin      : 生徒の可否 (1コマ1ビット、np.packbits)
+# teacher_cap.bin        : コーチの受け入れ人数 (1コマ1バイト)
+# requirements.bin       : 希望数 (生徒 × 教科の int32, リトルエンディアン)
+SAVE_FORMAT = "juku-schedule"
+SAVE_VERSION = 1
+ZIP_MAGIC = b"PK\x03\x04"
+# 以前の .pkl に入っている型 (dict・DataFrame・日付) を組み立てるのに要るものだけ。古い版の pandas / numpy の置き場所も含む
+LEGACY_PICKLE_GLOBALS = frozenset([
+    ("builtins", "slice"), ("builtins", "bytearray"), ("builtins", "set"), ("builtins", "frozenset"), ("_codecs", "encode"),
+    ("datetime", "date"), ("datetime", "datetime"), ("datetime", "time"), ("datetime", "timedelta"),
+    ("numpy", "ndarray"), ("numpy", "dtype"),
+    ("numpy.core.multiarray", "_reconstruct"), ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"), ("numpy._core.multiarray", "scalar"),
+    ("numpy.core.numeric", "_frombuffer"), ("numpy._core.numeric", "_frombuffer"),
+    ("pandas", "DataFrame"), ("pandas.core.frame", "DataFrame"), ("pandas", "Series"), ("pandas.core.series", "Series"),
+    ("pandas", "Index"), ("pandas.core.indexes.base", "Index"), ("pandas.core.indexes.base", "_new_Index"),
+    ("pandas", "RangeIndex"), ("pandas.core.indexes.range", "RangeIndex"),
+    ("pandas.core.internals.managers", "BlockManager"), ("pandas._libs.internals", "_unpickle_block"),
+    ("pandas.core.internals.blocks", "new_block"),
+    # pandas 3 の文字列列 (pyarrow)
+    ("pandas", "StringDtype"), ("pandas.core.arrays.string_", "StringDtype"), ("pandas.arrays", "ArrowStringArray"),
+    ("pandas.core.arrays.string_arrow", "ArrowStringArray"),
+    ("pyarrow.lib", "_restore_array"), ("pyarrow.lib", "py_buffer"), ("pyarrow.lib", "type_for_alias"),
+])
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """LEGACY_PICKLE_GLOBALS にない関数・クラスを呼ぼうとする pickle は読まない"""
+    def find_class(self, module, name):
+        if ({"__builtin__": "builtins"}.get(module, module), name) not in LEGACY_PICKLE_GLOBALS:
+            raise pickle.UnpicklingError(f"以前の保存データにない型が含まれています: {module}.{name}")
+        return super().find_class(module, name)
+
+def encode_save_data(saved):
+    """保存データ (teacher_name, student_list, calendar_config, shift_store, student_req_df) を zip のバイト列にする"""
+    store = saved["shift_store"]
+    codes = np.ascontiguousarray(store["codes"], dtype=np.uint8)
+    req_df = saved["student_req_df"]
+    req_names = [str(n) for n in req_df["生徒名"]]
+    req_counts = np.zeros((len(req_names), len(SUBJECTS)), dtype="<i4")
+    for k, subj in enumerate(SUBJECTS):
+        if subj in req_df.columns: req_counts[:, k] = req_df[subj].fillna(0).to_numpy(dtype="<i4")
+    header = {
+        "format": SAVE_FORMAT,
+        "version": SAVE_VERSION,
+        "teacher_name": saved.get("teacher_name", ""),
+        "student_list": list(saved.get("student_list", [])),
+        "calendar_config": dump_calendar_config(saved["calendar_config"]),
+        "shift": {
+            "start_date": store["start_date"].strftime("%Y-%m-%d"),
+            "student_names": list(store["student_names"]),
+            "n_days": codes.shape[1],
+            "n_periods": codes.shape[2]
+        },
+        "requirements": {"subjects": SUBJECTS, "student_names": req_names}
+    }
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("header.json", json.dumps(header, ensure_ascii=False))
+        zf.writestr("student_avail.bin", np.packbits(codes[1:] & 1, bitorder="little").tobytes())
+        zf.writestr("teacher_cap.bin", ((codes[0] >> 1) & 3).tobytes())
+        zf.writestr("requirements.bin", req_counts.tobytes())
+    return output.getvalue()
+
+def decode_save_data(file):
+    """encode_save_data の逆。希望数は DataFrame にせず {"student_names", "counts"} の配列で返す"""
+    with zipfile.ZipFile(file) as zf:
+        header = json.loads(zf.read("header.json").decode("utf-8"))
+        if header.get("format") != SAVE_FORMAT: raise ValueError("時間割の保存データではありません")
+        if header.get("version", 0) > SAVE_VERSION:
+            raise ValueError(f"新しい版の保存データです (版数 {header['version']})。アプリを更新してください")
+        shift = header["shift"]
+        n_people, n_days, n_periods = 1 + len(shift["student_names"]), shift["n_days"], shift["n_periods"]
+        n_cells = (n_people - 1) * n_days * n_periods
+        student_ok = np.unpackbits(np.frombuffer(zf.read("student_avail.bin"), dtype=np.uint8), count=n_cells, bitorder="little")
+        teacher_cap = np.frombuffer(zf.read("teacher_cap.bin"), dtype=np.uint8)
+        if teacher_cap.size != n_days * n_periods: raise ValueError("保存データが壊れています (teacher_cap.bin)")
+        req_info = header["requirements"]
+        counts = np.frombuffer(zf.read("requirements.bin"), dtype="<i4")
+        counts = counts.reshape(len(req_info["student_names"]), len(req_info["subjects"]))
+
+    codes = np.empty((n_people, n_days, n_periods), dtype=np.uint8)
+    codes[0] = np.array([MARK_CODES[m] for m in TEACHER_MARKS], dtype=np.uint8)[teacher_cap].reshape(n_days, n_periods)
+    codes[1:] = np.where(student_ok.reshape(n_people - 1, n_days, n_periods), MARK_CODES["〇"], MARK_CODES["×"])
+    # 教科の並びが変わっていても名前で合わせる
+    req_counts = np.zeros((counts.shape[0], len(SUBJECTS)), dtype=np.int32)
+    for k, subj in enumerate(SUBJECTS):
+        if subj in req_info["subjects"]: req_counts[:, k] = counts[:, req_info["subjects"].index(subj)]
+    return {
+        "version": header["version"],
+        "teacher_name": header.get("teacher_name", ""),
+        "student_list": header.get("student_list", []),
+        "calendar_config": parse_calendar_config(header["calendar_config"]),
+        "shift_store": {
+            "start_date": datetime.date.fromisoformat(shift["start_date"]),
+            "student_names": list(shift["student_names"]),
+            "codes": codes
+        },
+        "requirements": {"student_names": list(req_info["student_names"]), "counts": req_counts}
+    }
+
+def requirements_df(requirements):
+    """decode_save_data の希望数を、画面・計算で使う希望数表 (DataFrame) にする"""
+    import pandas as pd
+    df = pd.DataFrame(requirements["counts"], columns=SUBJECTS)
+    df.insert(0, "生徒名", requirements["student_names"])
+    return df
+
+def read_save_file(file, fallback_config=None):
+    """保存データを読み込む (zip 形式、または以前の .pkl 形式)
+    戻り値は teacher_name, student_list, calendar_config, shift_store, student_req_df を持つ dict
+    .pkl は以前の保存データに入っている型 (LEGACY_PICKLE_GLOBALS) だけを組み立て、それ以外を含むものは読まない"""
+    head = file.read(4)
+    file.seek(0)
+    if head == ZIP_MAGIC:
+        saved = decode_save_data(file)
+        saved["student_req_df"] = requirements_df(saved.pop("requirements"))
+        return saved
+    legacy = _LegacyUnpickler(file).load()
+    config = legacy.get("calendar_config") or fallback_config
+    if config is None: raise ValueError("calendar_config がありません")
+    cal_index = build_calendar_index(config["start_date"], config["end_date"], config.get("overrides", {}))
+    return {
+        "version": 0,
+        "teacher_name": legacy.get("teacher_name", ""),
+        "student_list": legacy.get("student_list") or get_student_names(legacy["student_req_df"]),
+        "calendar_config": config,
+        "shift_store": shift_store_from_saved(legacy, cal_index),
+        "student_req_df": legacy["student_req_df"]
+    }
+
+# ==========================================
+# 10. 校舎全体 (複数コーチ) の時間割
+# ==========================================
+def student_slot_matrix(result):
+    """(生徒数, コマ数) の bool 配列。生徒の授業が入っているコマが True"""
+    seats = np.asarray(result["slots"], dtype=np.int32).reshape(-1, MAX_SEATS)
+    occupied = np.zeros((len(result["student_names"]), len(seats)), dtype=bool)
+    sid, seat = np.nonzero(seats >= 0)
+    occupied[seats[sid, seat] >> 3, sid] = True
+    return occupied
+
+def _solve_coach(avail, reqs, mode):
+    return solve_flow(avail, reqs) if mode == "flow" else solve_greedy(avail, reqs)
+
+def solve_school(coaches, mode="greedy", max_workers=None):
+    """複数コーチの時間割をまとめて作る。coaches は {"avail", "reqs"} のリストで、期間は全員同じにする。
+    生徒は名前で校舎全体の1人として扱う (同じ生徒が複数のコーチの授業を受けられる)。
+    1. コーチごとの時間割をプロセスプールで並列に作る
+    2. 先に並んだコーチから順に確定させ、後のコーチは「同じ生徒が確定済みの授業を受けるコマ」を塞ぎ、
+       1日3コマの上限もほかのコーチの授業と合わせて数えたうえで、ぶつかった授業だけを差分修正で入れ直す"""
+    if not coaches: return {"results": [], "conflicts": 0, "removed": 0, "added": 0}
+    dates = list(coaches[0]["avail"]["dates"])
+    for c in coaches[1:]:
+        if list(c["avail"]["dates"]) != dates: raise ValueError("コーチによって期間が違うため、まとめて計算できません")
+    n_days = len(dates)
+    n_slots = n_days * 6
+    pool = {}  # 生徒名 → 校舎全体での番号
+    for c in coaches:
+        for name in c["avail"]["student_names"]: pool.setdefault(name, len(pool))
+
+    # 1. コーチごとに並列で解く
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(coaches)))
+    if max_workers == 1:
+        results = [_solve_coach(c["avail"], c["reqs"], mode) for c in coaches]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+            results = list(executor.map(_solve_coach, [c["avail"] for c in coaches], [c["reqs"] for c in coaches], [mode] * len(coaches)))
+
+    # 2. 生徒のダブルブッキングと1日の上限超えを、後のコーチ側で直す
+    busy = np.zeros((len(pool), n_slots), dtype=bool)  # 確定済みのコーチの授業が入っているコマ
+    conflicts = removed = added = 0
+    for ci, c in enumerate(coaches):
+        avail, result = c["avail"], results[ci]
+        n_students = len(avail["student_names"])
+        gids = np.array([pool[name] for name in avail["student_names"]], dtype=np.intp)
+        taken = busy[gids]
+        own = student_slot_matrix(result)
+        daily_used = taken.reshape(n_students, n_days, 6).sum(axis=2)
+        clash = np.argwhere(own & taken)
+        over = np.argwhere(own.reshape(n_students, n_days, 6).sum(axis=2) + daily_used > 3)
+        if len(clash) or len(over):
+            codes = avail["codes"].copy()
+            student_codes = codes[1:].reshape(n_students, n_slots)
+            student_codes[taken] &= 0xFE
+            cells = [(1 + s, sid // 6, sid % 6) for s, sid in clash] + [(1 + s, di, 0) for s, di in over]
+            result = repair_schedule(dict(avail, codes=codes), result, c["reqs"], changed_cells=cells, daily_used=daily_used)
+            results[ci] = result
+            conflicts += len(clash) + len(over)
+            removed += result["repair"]["removed"]
+            added += result["repair"]["added"]
+        busy[gids] |= student_slot_matrix(result)
+    return {"results": results, "conflicts": conflicts, "removed": removed, "added": added}
+
+# ==========================================
+# 11. 別スレッドでの計算 (進み具合・中止)
+# ==========================================
+def new_solve_job(requested):
+    """別スレッドで動かす計算の状態。画面側は stage / placed / best_score を読み、cancel をセットして中止させる
+    stopped は計算が中止を受けて実際に途中で打ち切ったか (計算が終わったあとに中止が届いても立たない)"""
+    return {
+        "cancel": threading.Event(),
+        "stopped": False,
+        "stage": "",
+        "placed": 0,
+        "requested": requested,
+        "best_score": None,
+        "started": time.monotonic(),
+        "done": False,
+        "result": None,
+        "error": None
+    }
+
+def job_reporter(job, stage):
+    """solver に渡す on_progress。進み具合を job に書き、中止されていたら stopped を立てて True を返す"""
+    job["stage"] = stage
+    def on_progress(placed, score=None):
+        job["placed"] = placed
+        if score is not None: job["best_score"] = score
+        if job["cancel"].is_set(): job["stopped"] = True
+        return job["stopped"]
+    return on_progress
+
+def start_solve_job(job, fn):
+    """fn(job) を別スレッドで実行し、戻り値を job["result"] (例外は job["error"]) に入れる"""
+    def run():
+        try:
+            job["result"] = fn(job)
+        except Exception as e:
+            job["error"] = e
+        finally:
+            job["done"] = True
+    job["thread"] = threading.Thread(target=run, daemon=True)
+    job["thread"].start()
+    return job
+
+# ==========================================
+# 12. シフトの一括読み込み (Excel / CSV)
+# ==========================================
+IMPORT_NG_MARKS = ["×", "x", "X", "✕", "NG", "-", "ー", "0"]  # 「行けない」と読む記号 (空欄も同じ)
+IMPORT_ERROR_LIMIT = 100  # 一覧で返す読めなかったセルの件数 (理由ごとの件数はすべて数える)
+IMPORT_COLUMNS = {
+    "name": ("生徒名", "名前", "氏名"),
+    "date": ("日付",),
+    "period": ("講", "時限", "コマ"),
+    "mark": ("可否", "記号", "シフト")
+}
+IMPORT_DATE_RE = re.compile(r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})")
+IMPORT_NUMBER_RE = re.compile(r"\d+")
+
+def import_mark_code(val):
+    """一括読み込み用の記号 → コード。行ける記号でも行けない記号でもない値は -1"""
+    text = str(val).strip()
+    code = MARK_CODES[text] if text in MARK_CODES else mark_code(text)
+    if code == 0 and text not in MARK_CODES and text not in IMPORT_NG_MARKS: return -1
+    return code
+
+def _import_date(value, cal_index):
+    if isinstance(value, datetime.datetime): return value.date()
+    if isinstance(value, datetime.date): return value
+    match = IMPORT_DATE_RE.search(str(value))
+    if match:
+        try: return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError: return None
+    return resolve_header_date(str(value).strip(), cal_index)
+
+def _import_period(value):
+    """講の番号 (「1講」なども可)。数字がなければ None"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool): return int(value)
+    match = IMPORT_NUMBER_RE.search(str(value)) if value is not None else None
+    return int(match.group()) if match else None
+
+def _import_sheets(file, filename):
+    """(シート名, 行のイテレータ) を順に返す。Excel は read_only で1行ずつ読む"""
+    if filename.lower().endswith(".csv"):
+        raw = file.read() if hasattr(file, "read") else bytes(file)
+        try: text = raw.decode("utf-8-sig")
+        except UnicodeDecodeError: text = raw.decode("cp932")
+        yield os.path.splitext(os.path.basename(filename))[0], csv.reader(io.StringIO(text))
+        return
+    from openpyxl import load_workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets: yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _import_table_columns(header):
+    """一覧表の見出し行なら (生徒名, 日付, 講, 可否) の列番号、そうでなければ None"""
+    labels = [str(v).strip() if v is not None else "" for v in header]
+    columns = []
+    for key in ("name", "date", "period", "mark"):
+        col = next((i for i, label in enumerate(labels) if label in IMPORT_COLUMNS[key]), None)
+        if col is None: return None
+        columns.append(col)
+    return columns
+
+def import_availability(file, filename, store, cal_index):
+    """生徒の行ける日時を Excel (.xlsx) / CSV からまとめて読み込み、store に書き込む。形式はシートごとに判定する
+      一覧表: 見出し行に「生徒名・日付・講・可否」があり、1行に1コマ (CSV はこの形式だけ)
+      生徒ごとのシート: シート名が生徒名で、見出し行に日付、1列目に講 (週ごとに見出し行を繰り返してもよい)
+    空欄は「×」として読む。読めなかったセルは書き込まずに報告する。
+    戻り値は {"cells": 書き込んだセル数, "changed": 可否が変わったセル数, "students": 生徒数,
+              "errors": 読めなかったセル (先頭 IMPORT_ERROR_LIMIT 件), "error_counts": 理由ごとの件数}"""
+    person_of = {name: 1 + i for i, name in enumerate(store["student_names"])}
+    date_index = cal_index["date_index"]
+    persons, days, periods = array('i'), array('i'), array('b')
+    origins = array('q')  # セルごとの (シート番号 << 32 | 行番号)。読めなかった記号の報告用
+    marks = []
+    sheet_names = []
+    errors, error_counts = [], {}
+    def error(sheet, row, value, reason):
+        error_counts[reason] = error_counts.get(reason, 0) + 1
+        if len(errors) < IMPORT_ERROR_LIMIT: errors.append({"シート": sheet, "行": row, "値": str(value), "理由": reason})
+    # 日付・講・名前は同じ値が何度も出てくるので、値ごとに1回だけ変換する
+    date_cache, period_cache = {}, {}
+    def day_of(value):
+        """日付番号。読めなければ -2、期間外なら -1"""
+        if value not in date_cache:
+            d = _import_date(value, cal_index)
+            date_cache[value] = -2 if d is None else date_index.get(d, -1)
+        return date_cache[value]
+    def period_of(value):
+        if value not in period_cache: period_cache[value] = _import_period(value)
+        return period_cache[value]
+    def header_days(sheet, r, row):
+        """見出し行 → (列番号のリスト, 日付番号のリスト)"""
+        cols, col_days = [], []
+        for c, value in enumerate(row):
+            if c == 0 or value is None or str(value).strip() == "": continue
+            day = day_of(value)
+            if day >= 0:
+                cols.append(c)
+                col_days.append(day)
+            else:
+                error(sheet, r, value, "期間外の日付" if day == -1 else "日付が読めない")
+        return cols, col_days
+
+    for sheet, rows in _import_sheets(file, filename):
+        sheet_id = len(sheet_names)
+        sheet_names.append(sheet)
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None: continue
+        columns = _import_table_columns(header)
+        if columns is not None:
+            name_col, date_col, period_col, mark_col = columns
+            width = max(columns) + 1
+            for r, row in enumerate(rows, start=2):
+                if len(row) < width: row = tuple(row) + (None,) * (width - len(row))
+                name = row[name_col]
+                person = person_of.get(name)
+                if person is None:
+                    if name is None or str(name).strip() == "": continue
+                    person = person_of.get(str(name).strip())
+                    if person is None:
+                        error(sheet, r, name, "生徒リストにない名前")
+                        continue
+                day = day_of(row[date_col])
+                if day < 0:
+                    error(sheet, r, row[date_col], "期間外の日付" if day == -1 else "日付が読めない")
+                    continue
+                period = period_of(row[period_col])
+                if period not in PERIODS:
+                    error(sheet, r, row[period_col], "講が読めない")
+                    continue
+                persons.append(person); days.append(day); periods.append(period - 1)
+                origins.append(sheet_id << 32 | r)
+                marks.append(row[mark_col])
+            continue
+        person = person_of.get(sheet.strip())
+        if person is None:
+            error(sheet, 1, sheet, "生徒リストにない名前 (シート名)")
+            continue
+        cols, col_days = header_days(sheet, 1, header)
+        for r, row in enumerate(rows, start=2):
+            if not row: continue
+            period = period_of(row[0])
+            if period is None:
+                # 週ごとに繰り返した見出し行
+                if any(v is not None and str(v).strip() != "" for v in row[1:]): cols, col_days = header_days(sheet, r, row)
+                continue
+            if period not in PERIODS:
+                error(sheet, r, row[0], "講が読めない")
+                continue
+            # 1行分 (1週間分など) をまとめて足す
+            n = len(cols)
+            persons.extend([person] * n)
+            days.extend(col_days)
+            periods.extend([period - 1] * n)
+            origins.extend([sheet_id << 32 | r] * n)
+            if n and cols[-1] < len(row): marks.extend([row[c] for c in cols])
+            else: marks.extend([row[c] if c < len(row) else None for c in cols])
+
+    # 記号は種類ごとに1回だけ変換し、配列で引く (空欄は「×」)
+    import pandas as pd
+    mark_ids, uniques = pd.factorize(pd.Series(marks, dtype=object))
+    table = np.array([import_mark_code(v) for v in uniques] + [MARK_CODES[""]], dtype=np.int16)
+    codes = table[mark_ids]
+    bad = np.flatnonzero(codes < 0)
+    for i in bad[:IMPORT_ERROR_LIMIT].tolist():
+        error(sheet_names[origins[i] >> 32], origins[i] & 0xFFFFFFFF, uniques[mark_ids[i]], "記号が読めない")
+    if len(bad) > IMPORT_ERROR_LIMIT: error_counts["記号が読めない"] += len(bad) - IMPORT_ERROR_LIMIT
+    good = codes >= 0
+    p = np.frombuffer(persons, dtype=np.int32)[good]
+    d = np.frombuffer(days, dtype=np.int32)[good]
+    q = np.frombuffer(periods, dtype=np.int8)[good]
+    new_codes = codes[good].astype(np.uint8)
+    target = store["codes"]
+    changed = int(((target[p, d, q] & 1) != (new_codes & 1)).sum())
+    target[p, d, q] = new_codes
+    return {
+        "cells": int(good.sum()),
+        "changed": changed,
+        "students": int(len(np.unique(p))),
+        "errors": errors,
+        "error_counts": error_counts
+    }